@@ -0,0 +1,84 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from src.tools.retrieval_table import RetrievalTable
+from src.utils.SnippetStore import SnippetStore
+
+
+def make_table(embeddings, storage='float32', pca_dim=None):
+    table = RetrievalTable(SnippetStore(), encoder_path='', storage=storage, pca_dim=pca_dim)
+    rows = [str(i) for i in range(len(embeddings))]
+    table.add_embeddings(rows, rows, embeddings)
+    return table
+
+
+def clustered(rng, n, centers, basis, noise):
+    """
+    Rows scattered around shared centers inside the span of basis, plus a little isotropic noise, so that
+    nearest neighbours are meaningful and the spectrum decays like that of real sentence embeddings.
+    """
+    dim = centers.shape[1]
+    rows = centers[rng.integers(0, len(centers), n)] + noise * rng.standard_normal((n, len(basis))) @ basis
+    return (rows + 0.05 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    basis = rng.standard_normal((args.intrinsic_dim, args.dim)).astype(np.float32) / np.sqrt(args.intrinsic_dim)
+    centers = (rng.standard_normal((args.clusters, args.intrinsic_dim)) @ basis).astype(np.float32)
+    configs = [('float16', None), ('int8', None)] + [(storage, dim) for dim in args.pca_dims
+                                                    for storage in ('float32', 'float16', 'int8')]
+    for size in args.sizes:
+        embeddings = clustered(rng, size, centers, basis, args.noise)
+        query_vectors = clustered(rng, args.queries, centers, basis, args.noise)
+        baseline = make_table(embeddings)
+        truth, _ = baseline.search(query_vectors, args.top_k)
+        baseline.search(query_vectors[:1], 1)
+        start = time.perf_counter()
+        baseline.search(query_vectors, args.top_k)
+        baseline_seconds = time.perf_counter() - start
+
+        for storage, pca_dim in configs:
+            table = make_table(embeddings, storage, pca_dim)
+            start = time.perf_counter()
+            table.search(query_vectors[:1], 1)
+            compact_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            found, _ = table.search(query_vectors, args.top_k)
+            search_seconds = time.perf_counter() - start
+            recall = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, truth)])
+            stats = table.get_storage_stats()
+            print(json.dumps({
+                'snippets': size,
+                'storage': storage,
+                'pca_dim': pca_dim,
+                f'recall@{args.top_k}': float(recall),
+                'bytes': stats['bytes'],
+                'float32_bytes': stats['float32_bytes'],
+                'saved_ratio': stats['saved_ratio'],
+                'compact_seconds': compact_seconds,
+                'search_seconds': search_seconds,
+                'float32_search_seconds': baseline_seconds,
+            }))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Memory and recall@k of reduced-precision retrieval tables against float32.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000],
+                        help='Numbers of snippets in the table.')
+    parser.add_argument('--pca_dims', type=int, nargs='*', default=[128],
+                        help='PCA dimensions to try in addition to the full dimension.')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--dim', type=int, default=384,
+                        help='Embedding dimension (384 for all-MiniLM-L6-v2).')
+    parser.add_argument('--intrinsic_dim', type=int, default=96,
+                        help='Dimension of the subspace holding most of the variance.')
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.5,
+                        help='Spread of the rows around their cluster center.')
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
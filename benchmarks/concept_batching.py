@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+from src.tools.mindmap import MindMap, MindPoint
+
+
+def total_tokens(usage):
+    return sum(u['prompt_tokens'] + u['completion_tokens'] for u in usage.values())
+
+
+def collect_workloads(root: MindPoint, max_nodes: int):
+    """The children of every extended node, as ConceptGenerator saw them: {category: info}."""
+    workloads = []
+
+    def traverse(node: MindPoint):
+        if len(workloads) >= max_nodes:
+            return
+        if len(node.children) > 1:
+            workloads.append({category: child.info for category, child in node.children.items()})
+        for child in node.children.values():
+            traverse(child)
+
+    traverse(root)
+    return workloads
+
+
+def main(args):
+    kwargs = {
+        'temperature': 1.0,
+        'top_p': 0.9,
+    }
+    if args.provider == 'deepseek':
+        from src.tools.lm import DeepSeekModel
+        lm = DeepSeekModel(model=args.llm, max_tokens=2000, **kwargs)
+    else:
+        from src.tools.lm import OpenAIModel_dashscope
+        lm = OpenAIModel_dashscope(model=args.llm, max_tokens=2000, api_key=os.getenv("OPENAI_API_KEY"), **kwargs)
+
+    mind_map = MindMap(retriever=None, gen_concept_lm=lm, depth=1)
+    root = mind_map.load_map(args.mappath)
+    generator = mind_map.concept_generator
+    workloads = collect_workloads(root, args.nodes)
+
+    modes = {
+        'sequential': lambda infos: {c: generator.forward(i) for c, i in infos.items()},
+        'parallel': lambda infos: generator.forward_parallel(infos, max_thread_num=args.threadnum),
+        'batch': lambda infos: generator.forward_batch(infos, batch_size=args.batch_size, max_thread_num=args.threadnum),
+    }
+    report = {'nodes': len(workloads), 'categories': sum(len(w) for w in workloads), 'modes': {}}
+    for mode, run in modes.items():
+        lm.get_usage_and_reset()
+        latencies = []
+        empty = 0
+        for infos in workloads:
+            start = time.perf_counter()
+            concepts = run(infos)
+            latencies.append(time.perf_counter() - start)
+            empty += sum(not concept_list for concept_list in concepts.values())
+        report['modes'][mode] = {
+            'total_seconds': sum(latencies),
+            'mean_seconds_per_node': sum(latencies) / len(latencies) if latencies else 0.0,
+            'tokens': total_tokens(lm.get_usage_and_reset()),
+            'empty_concept_lists': empty,
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare per-category, parallel and batched concept generation on a saved mind map.')
+    parser.add_argument('--mappath', type=str, required=True,
+                        help='A mind map saved by MindMap.save_map.')
+    parser.add_argument('--provider', type=str, default='deepseek', choices=['deepseek', 'dashscope'],
+                        help='Which LM wrapper from src/tools/lm.py to use.')
+    parser.add_argument('--llm', type=str, default='deepseek-chat',
+                        help='The language model to use for generating concepts.')
+    parser.add_argument('--nodes', type=int, default=10,
+                        help='Maximum number of extended nodes to replay.')
+    parser.add_argument('--batch_size', type=int, default=4,
+                        help='Categories per request in batch mode.')
+    parser.add_argument('--threadnum', type=int, default=4,
+                        help='Concurrent requests in parallel and batch modes.')
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from src.tools.mindmap import MindMap
+
+
+def make_synthetic_map(num_nodes, branching, infos_per_node, snippets_per_info, snippet_chars):
+    """Build a save_map style dict with num_nodes nodes. URLs repeat across nodes, as they do in real maps."""
+    def make_info(node_id, j):
+        url = f'https://example.com/page/{(node_id * infos_per_node + j) % max(num_nodes, 1)}'
+        return {
+            'url': url,
+            'title': f'Title of {url}',
+            'description': f'Description of {url}',
+            'snippets': [f'{url} snippet {k} ' + 'x' * snippet_chars for k in range(snippets_per_info)],
+        }
+
+    nodes = [{'category': 'topic', 'concept': ['concept 1', 'concept 2'], 'children': {},
+              'info': [make_info(0, j) for j in range(infos_per_node)]}]
+    for node_id in range(1, num_nodes):
+        node = {'category': f'category {node_id}', 'concept': ['concept 1', 'concept 2'], 'children': {},
+                'info': [make_info(node_id, j) for j in range(infos_per_node)]}
+        nodes[(node_id - 1) // branching]['children'][node['category']] = node
+        nodes.append(node)
+    return nodes[0]
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'map.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(make_synthetic_map(args.nodes, args.branching, args.infos, args.snippets, args.snippet_chars), f)
+
+        mind_map = MindMap(retriever=None, gen_concept_lm=None, depth=1)
+        tracemalloc.start()
+        start = time.perf_counter()
+        mind_map.load_map(path)
+        load_seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        mind_map.get_all_infos()
+        traverse_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        'nodes': args.nodes,
+        'load_seconds': load_seconds,
+        'traverse_seconds': traverse_seconds,
+        'resident_bytes': current,
+        'peak_bytes': peak,
+        'bytes_per_node': current / args.nodes,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Measure the memory footprint of loading and traversing a large mind map.')
+    parser.add_argument('--nodes', type=int, default=20000,
+                        help='Number of MindPoints in the synthetic map.')
+    parser.add_argument('--branching', type=int, default=6,
+                        help='Children per MindPoint.')
+    parser.add_argument('--infos', type=int, default=3,
+                        help='Search results (URLs) per MindPoint.')
+    parser.add_argument('--snippets', type=int, default=3,
+                        help='Snippets per search result.')
+    parser.add_argument('--snippet_chars', type=int, default=200,
+                        help='Length of each snippet.')
+    main(parser.parse_args())
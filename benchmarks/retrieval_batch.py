@@ -0,0 +1,71 @@
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from src.tools.retrieval_table import RetrievalTable
+from src.utils.SnippetStore import SnippetStore
+
+
+def per_query_top_k(query_vectors, embeddings, top_k):
+    """The previous retrieve_information path: one cosine_similarity call and a full argsort per query."""
+    results = []
+    for query_vector in query_vectors:
+        sim = cosine_similarity([query_vector], embeddings)[0]
+        results.append(np.argsort(sim)[-top_k:][::-1])
+    return np.array(results)
+
+
+def make_table(embeddings):
+    table = RetrievalTable(SnippetStore(), encoder_path='')
+    rows = [str(i) for i in range(len(embeddings))]
+    table.add_embeddings(rows, rows, embeddings)
+    return table
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    report = []
+    for size in args.sizes:
+        embeddings = rng.standard_normal((size, args.dim), dtype=np.float32)
+        query_vectors = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+        table = make_table(embeddings)
+
+        start = time.perf_counter()
+        table.normalized_embeddings
+        prepare_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        baseline = per_query_top_k(query_vectors, embeddings, args.top_k)
+        baseline_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched, _ = table.search(query_vectors, args.top_k)
+        batched_seconds = time.perf_counter() - start
+
+        report.append({
+            'snippets': size,
+            'queries': args.queries,
+            'prepare_seconds': prepare_seconds,
+            'per_query_seconds': baseline_seconds,
+            'batched_seconds': batched_seconds,
+            'speedup': baseline_seconds / batched_seconds if batched_seconds else None,
+            'same_top_k': bool(np.array_equal(np.sort(baseline, axis=1), np.sort(batched, axis=1))),
+        })
+        print(json.dumps(report[-1]))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare per-query and batched top-k retrieval over random embeddings.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='Numbers of snippets in the table.')
+    parser.add_argument('--queries', type=int, default=20,
+                        help='Queries per retrieve_information call (one section outline).')
+    parser.add_argument('--dim', type=int, default=384,
+                        help='Embedding dimension (384 for all-MiniLM-L6-v2).')
+    parser.add_argument('--top_k', type=int, default=3,
+                        help='search_top_k.')
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,183 @@
+import json
+import os
+import resource
+import subprocess
+import time
+import tracemalloc
+import zlib
+from argparse import ArgumentParser
+
+import numpy as np
+
+from src.tools.encoder import register_encoder
+from src.tools.mindmap import MindMap
+
+STUB_ENCODER_PATH = 'stub://hashing'
+
+
+class HashingEncoder():
+    """
+    Offline stand-in for a SentenceTransformer: a signed hashed bag of words. Texts sharing words get
+    similar vectors, which is enough to exercise retrieval at realistic sizes without a model.
+    """
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self._columns = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                column = self._columns.get(word)
+                if column is None:
+                    h = zlib.crc32(word.encode('utf-8'))
+                    column = self._columns[word] = (h % self.dim, 1.0 if h >> 31 else -1.0)
+                vectors[i, column[0]] += column[1]
+        return vectors[0] if single else vectors
+
+
+def make_corpus(rng, num_snippets, snippets_per_page, snippet_words, topics, vocabulary):
+    """
+    Synthetic pages in the form MindPoint info takes. Each page belongs to a topic and its snippets mix
+    Zipf-distributed words of that topic with common filler words.
+    """
+    topic_words = rng.integers(0, vocabulary, (topics, 200))
+    filler = [f'the{i}' for i in range(50)]
+    pages = []
+    for page_id in range(-(-num_snippets // snippets_per_page)):
+        topic = page_id % topics
+        snippets = []
+        for _ in range(min(snippets_per_page, num_snippets - page_id * snippets_per_page)):
+            ranks = np.minimum(rng.zipf(1.5, snippet_words), 200) - 1
+            words = [f'w{topic_words[topic, r]}' if r % 3 else filler[r % 50] for r in ranks]
+            snippets.append(' '.join(words))
+        pages.append({'url': f'https://example.com/{topic}/{page_id}', 'title': f'page {page_id}',
+                      'description': '', 'snippets': snippets})
+    return pages, topic_words
+
+
+def make_queries(rng, num_queries, topic_words):
+    """Short heading-like queries of two to four topic words, as get_outline_as_list produces."""
+    queries = []
+    for _ in range(num_queries):
+        topic = rng.integers(0, len(topic_words))
+        ranks = rng.integers(0, 20, rng.integers(2, 5))
+        queries.append(' '.join(f'w{topic_words[topic, r]}' for r in ranks))
+    return queries
+
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1000
+    return {f'p{p}': float(np.percentile(values, p)) for p in (50, 90, 99)} | {'mean': float(values.mean())}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(args, size, map_options):
+    rng = np.random.default_rng(args.seed)
+    pages, topic_words = make_corpus(rng, size, args.snippets_per_page, args.snippet_words, args.topics,
+                                     args.vocabulary)
+    queries = make_queries(rng, args.queries, topic_words)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    mind_map = MindMap(retriever=None, gen_concept_lm=None, depth=1, **map_options)
+    start = time.perf_counter()
+    for page in pages:
+        mind_map.store.add_info(page)
+    mind_map.prepare_table_for_retrieval()
+    build_seconds = time.perf_counter() - start
+
+    mind_map.retrieve_information(queries[:1], args.top_k)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        mind_map.retrieve_information(query, args.top_k)
+        latencies.append(time.perf_counter() - start)
+
+    groups = [queries[i:i + args.queries_per_section] for i in range(0, len(queries), args.queries_per_section)]
+    start = time.perf_counter()
+    mind_map.retrieve_information_batch(groups, args.top_k)
+    batch_seconds = time.perf_counter() - start
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    if args.trace_memory:
+        tracemalloc.stop()
+    return {
+        'snippets': len(mind_map.collected_snippet_ids),
+        'pages': len(pages),
+        'build_seconds': build_seconds,
+        'build_snippets_per_second': size / build_seconds if build_seconds else None,
+        'query_latency_ms': percentiles(latencies),
+        'queries_per_second': len(latencies) / sum(latencies),
+        'batch_queries_per_second': len(queries) / batch_seconds if batch_seconds else None,
+        'traced_peak_bytes': traced_peak,
+        # ru_maxrss is in KiB on Linux and never decreases, so sizes should be run in increasing order.
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main(args):
+    if args.encoder_path:
+        os.environ['ENCODER_PATH'] = args.encoder_path
+    else:
+        os.environ['ENCODER_PATH'] = STUB_ENCODER_PATH
+        register_encoder(HashingEncoder(args.dim), STUB_ENCODER_PATH)
+    map_options = {
+        'index_backend': args.index_backend,
+        'table_storage': args.storage,
+        'retrieval_fusion': args.fusion,
+        'mmr_lambda': args.mmr_lambda,
+    }
+    report = {
+        'commit': git_commit(),
+        'encoder': args.encoder_path or f'{STUB_ENCODER_PATH}-{args.dim}',
+        'options': map_options,
+        'top_k': args.top_k,
+        'results': [],
+    }
+    for size in sorted(args.sizes):
+        result = run_size(args, size, map_options)
+        report['results'].append(result)
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build time, query latency, throughput and memory of mind map retrieval '
+                                        'over synthetic corpora, offline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000],
+                        help='Numbers of snippets in the corpus.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--queries_per_section', type=int, default=5,
+                        help='Queries per group in the retrieve_information_batch measurement.')
+    parser.add_argument('--top_k', type=int, default=3, help='search_top_k.')
+    parser.add_argument('--snippets_per_page', type=int, default=4)
+    parser.add_argument('--snippet_words', type=int, default=30)
+    parser.add_argument('--topics', type=int, default=100)
+    parser.add_argument('--vocabulary', type=int, default=50_000)
+    parser.add_argument('--encoder_path', type=str, default=None,
+                        help='A small local SentenceTransformer; the hashing stub encoder if not set.')
+    parser.add_argument('--dim', type=int, default=384, help='Dimension of the stub encoder.')
+    parser.add_argument('--index_backend', type=str, default='exact')
+    parser.add_argument('--storage', type=str, default='float32')
+    parser.add_argument('--fusion', type=str, default=None)
+    parser.add_argument('--mmr_lambda', type=float, default=None)
+    parser.add_argument('--trace_memory', action='store_true',
+                        help='Also report the tracemalloc peak of each size (slower).')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the full report, with the commit and options, to this JSON file.')
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
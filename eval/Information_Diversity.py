@@ -1,16 +1,24 @@
 import numpy as np
 import os
+import sys
 import json
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.tools.encoder import get_encoder, get_pooled_encoder
+from src.utils.EmbeddingCache import EmbeddingCache
 
-def calculate_snippet_similarities(snippets, model_path):
-    model = SentenceTransformer(model_path)  # 可选择其他模型
+
+def calculate_snippet_similarities(snippets, model_path, cache_dir=None, processes=None):
+    # 可选择其他模型; with processes, snippets are encoded by a pool of worker processes
+    model = get_pooled_encoder(model_path, processes) if processes else get_encoder(model_path)
 
     snippets = [" ".join(snippet) for snippet in snippets]
-    snippet_embeddings = model.encode(snippets)
+    if cache_dir:
+        snippet_embeddings = EmbeddingCache(cache_dir, model_path).encode(model, snippets)
+    else:
+        snippet_embeddings = model.encode(snippets)
     
     similarity_matrix = cosine_similarity(snippet_embeddings)
     
@@ -31,7 +39,7 @@ def get_snippets(data):
         all_snippets  = all_snippets + get_snippets(data['children'][child])
     return all_snippets
 
-def calculate_deepthink(path, model_path):
+def calculate_deepthink(path, model_path, cache_dir=None, processes=None):
     all_dirversity = []
     files = os.listdir(path)
     for file in files:
@@ -42,7 +50,7 @@ def calculate_deepthink(path, model_path):
             all_snippets = get_snippets(data)
             if len(all_snippets) == 1 or len(all_snippets) == 0:
                 continue
-            mean_similarity, similarities = calculate_snippet_similarities(all_snippets, model_path)
+            mean_similarity, similarities = calculate_snippet_similarities(all_snippets, model_path, cache_dir, processes)
             diversity = 1 - mean_similarity
             all_dirversity.append(diversity)
 
@@ -54,7 +62,7 @@ def main(args):
     map_path = args.mappath
     model_path = args.model_path
 
-    print(calculate_deepthink(map_path, model_path))
+    print(calculate_deepthink(map_path, model_path, args.cache_dir, args.processes))
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -63,6 +71,10 @@ if __name__ == '__main__':
                         help='Directory to store the articles.')
     parser.add_argument('--model_path', type=str, default='./models/paraphrase-MiniLM-L6-v2',
                         help='Directory to store the model.')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Directory of the persistent embedding cache shared with the mind map. Disabled if not set.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Encode snippets with this many CPU worker processes. In process if not set.')
     main(parser.parse_args())
 
 
@@ -27,7 +27,10 @@ def main(args):
         depth = args.depth
     )
 
-    generator = mind_map.build_map(topic)   
+    if not os.path.exists(f'{args.outputdir}/checkpoint'):
+        os.makedirs(f'{args.outputdir}/checkpoint')
+    generator = mind_map.build_map(topic, checkpoint_path=f'{args.outputdir}/checkpoint/{file_name}.jsonl',
+                                   resume=args.resume)
     for layer in generator:
         print(layer)
     mind_map.prepare_table_for_retrieval()
@@ -83,6 +86,8 @@ if __name__ == '__main__':
                         help='The language model API to use for generating content.')
     parser.add_argument('--depth', type=int, default=2,
                         help='The depth of knowledge seeking.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume building the mind map from its checkpoint in outputdir/checkpoint.')
 
 
     main(parser.parse_args())
\ No newline at end of file
@@ -31,9 +31,10 @@ class ArticleGenerationModule():
         self.section_gen = ConvToSection(engine=self.article_gen_lm)
 
 
-    def generate_section(self, topic, section_name, mindmap, section_query, section_outline):
-        collected_info = mindmap.retrieve_information(queries=section_query,
-                                                                    search_top_k=self.retrieve_top_k)
+    def generate_section(self, topic, section_name, mindmap, section_query, section_outline, collected_info=None):
+        if collected_info is None:
+            collected_info = mindmap.retrieve_information(queries=section_query,
+                                                          search_top_k=self.retrieve_top_k)
         output = self.section_gen(
             topic=topic,
             outline=section_outline,
@@ -56,12 +57,16 @@ class ArticleGenerationModule():
         sections_to_write = article_with_outline.get_first_level_section_names()
         section_output_dict_collection = []
 
+        section_queries = [
+            article_with_outline.get_outline_as_list(root_section_name=section_title, add_hashtags=False)
+            for section_title in sections_to_write
+        ]
+        # Retrieve the evidence of every section in one pass, so section writers start without retrieval.
+        section_infos = mindmap.retrieve_information_batch(section_queries, search_top_k=self.retrieve_top_k)
+
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num) as executor:
             future_to_sec_title = {}
-            for section_title in sections_to_write:
-                section_query = article_with_outline.get_outline_as_list(
-                    root_section_name=section_title, add_hashtags=False
-                )
+            for section_title, section_query, collected_info in zip(sections_to_write, section_queries, section_infos):
                 queries_with_hashtags = article_with_outline.get_outline_as_list(
                     root_section_name=section_title, add_hashtags=True
                 )
@@ -69,7 +74,7 @@ class ArticleGenerationModule():
 
                 future_to_sec_title[
                     executor.submit(self.generate_section, 
-                                    topic, section_title, mindmap, section_query,section_outline)
+                                    topic, section_title, mindmap, section_query, section_outline, collected_info)
                 ] = section_title
 
             for future in concurrent.futures.as_completed(future_to_sec_title):
@@ -110,6 +110,14 @@ class Article(article):
                 self.reference["url_to_unified_index"][url] = len(
                     self.reference["url_to_unified_index"]) + 1  # The citation index starts from 1.
                 self.reference["url_to_info"][url] = storm_info
+            elif 'snippet_ids' in storm_info and 'snippet_ids' in self.reference["url_to_info"][url]:
+                # Snippets from the mind map's snippet store are merged by ID; the texts are shared with the store.
+                existing_info = self.reference["url_to_info"][url]
+                merged = dict(zip(existing_info['snippet_ids'], existing_info['snippets']))
+                for snippet_id, snippet in zip(storm_info['snippet_ids'], storm_info['snippets']):
+                    merged.setdefault(snippet_id, snippet)
+                existing_info['snippet_ids'] = list(merged.keys())
+                existing_info['snippets'] = list(merged.values())
             else:
                 existing_snippets = self.reference["url_to_info"][url]['snippets']
                 existing_snippets.extend(storm_info['snippets'])
@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 import logging
 # Add repository root to sys.path
@@ -44,8 +45,13 @@ def generate_article(topic):
         question = topic.split("Question:")[1].split("Generate")[0].strip()
 
     try:
+        # Checkpoint the mind map so a failure later in the run does not throw it away. The checkpoint is
+        # per question and removed once the article is written, so only a failed run is resumed.
+        os.makedirs("results/checkpoint", exist_ok=True)
+        file_name = re.sub(r'[^\w-]+', '_', question)[:100]
+        checkpoint_path = f"results/checkpoint/{file_name}.jsonl"
         mind_map = MindMap(retriever=rm, gen_concept_lm=lm, depth=2)
-        generator = mind_map.build_map(question)
+        generator = mind_map.build_map(question, checkpoint_path=checkpoint_path, resume=True)
         layers = list(generator)  # Consume generator safely
         if not layers:
             logger.error("Mind map generation returned no layers.")
@@ -74,6 +80,7 @@ def generate_article(topic):
         os.makedirs("results", exist_ok=True)
         with open("results/article.md", "w", encoding="utf-8") as f:
             f.write(f"# {question}\n\n{polished_article.to_string()}")
+        os.remove(checkpoint_path)
     except Exception as e:
         logger.error(f"Article generation failed: {e}")
         raise
@@ -0,0 +1,223 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+DEFAULT_ENCODER_PATH = '/mnt/nas-alinlp/xizekun/huggingface_cache/all-MiniLM-L6-v2'
+
+
+def resolve_encoder_path(path: Optional[str] = None) -> str:
+    """The given model path, else the ENCODER_PATH environment variable, else the default model."""
+    return path or os.getenv('ENCODER_PATH') or DEFAULT_ENCODER_PATH
+
+
+def resolve_encoder_device(device: Optional[str] = None) -> Optional[str]:
+    """The given device, else the ENCODER_DEVICE environment variable; None lets SentenceTransformer pick."""
+    return device or os.getenv('ENCODER_DEVICE') or None
+
+
+class EncoderRegistry():
+    """
+    Loads each SentenceTransformer at most once per process and hands the same instance to every caller.
+
+    Models are keyed by (path, device) and loaded on first use, so importing a module that may need an
+    encoder costs nothing. Concurrent first requests for the same model wait for a single load.
+    """
+
+    def __init__(self):
+        self._encoders: Dict[Tuple[str, Optional[str]], SentenceTransformer] = {}
+        self._load_locks: Dict[Tuple[str, Optional[str]], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+        self.warmup_seconds: Dict[str, float] = {}
+        self.loads = 0
+        self.requests = 0
+
+    @staticmethod
+    def _key(path: Optional[str], device: Optional[str]) -> Tuple[str, Optional[str]]:
+        return resolve_encoder_path(path), resolve_encoder_device(device)
+
+    @staticmethod
+    def _name(key: Tuple[str, Optional[str]]) -> str:
+        path, device = key
+        return f'{path}@{device}' if device else path
+
+    def get(self, path: Optional[str] = None, device: Optional[str] = None) -> SentenceTransformer:
+        key = self._key(path, device)
+        with self._lock:
+            self.requests += 1
+            encoder = self._encoders.get(key)
+            if encoder is not None:
+                return encoder
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            encoder = self._encoders.get(key)
+            if encoder is None:
+                start = time.time()
+                encoder = SentenceTransformer(key[0], device=key[1])
+                elapsed = time.time() - start
+                logging.info(f'Loaded encoder {self._name(key)} in {elapsed:.2f}s')
+                with self._lock:
+                    self._encoders[key] = encoder
+                    self.load_seconds[self._name(key)] = elapsed
+                    self.loads += 1
+            return encoder
+
+    def warm_up(self, path: Optional[str] = None, device: Optional[str] = None,
+                texts: Sequence[str] = ('warm up',)) -> SentenceTransformer:
+        """Load the encoder and run one encode call, so the first real request does not pay for either."""
+        key = self._key(path, device)
+        encoder = self.get(*key)
+        start = time.time()
+        encoder.encode(list(texts), show_progress_bar=False)
+        with self._lock:
+            self.warmup_seconds[self._name(key)] = time.time() - start
+        return encoder
+
+    def register(self, encoder, path: Optional[str] = None, device: Optional[str] = None):
+        """Serve encoder for (path, device) instead of loading a model, e.g. an offline stub in benchmarks."""
+        with self._lock:
+            self._encoders[self._key(path, device)] = encoder
+
+    def is_loaded(self, path: Optional[str] = None, device: Optional[str] = None) -> bool:
+        with self._lock:
+            return self._key(path, device) in self._encoders
+
+    def clear(self):
+        """Drop every loaded encoder, e.g. to free memory in a long-running worker."""
+        with self._lock:
+            self._encoders.clear()
+            self._load_locks.clear()
+
+    def get_stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'loaded': [self._name(key) for key in self._encoders],
+                'loads': self.loads,
+                'requests': self.requests,
+                'load_seconds': dict(self.load_seconds),
+                'warmup_seconds': dict(self.warmup_seconds),
+            }
+
+
+class PooledEncoder():
+    """
+    Encodes with a pool of CPU worker processes, each holding its own copy of the model
+    (SentenceTransformer.start_multi_process_pool), for snippet sets too large for one process.
+
+    Texts are sorted by length before being sharded, so every batch holds texts of similar length and
+    little padding is computed; the embeddings are returned in the input order. Unless given, the batch
+    size is tuned on a sample of the first input large enough for the pool. Inputs shorter than min_pool_texts are encoded in
+    process, where the pool would cost more than it saves.
+    """
+
+    BATCH_SIZES = (16, 32, 64, 128, 256)
+
+    def __init__(self, path: Optional[str] = None, processes: Optional[int] = None,
+                 batch_size: Optional[int] = None, min_pool_texts: int = 512):
+        self.path = resolve_encoder_path(path)
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.min_pool_texts = min_pool_texts
+        self.model = get_encoder(self.path)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pool is None:
+                start = time.time()
+                self._pool = self.model.start_multi_process_pool(target_devices=['cpu'] * self.processes)
+                logging.info(f'Started {self.processes} encoder processes in {time.time() - start:.2f}s')
+            return self._pool
+
+    def stop(self):
+        with self._lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def tune_batch_size(self, texts: Sequence[str], sample_size: int = 256) -> int:
+        """The batch size from BATCH_SIZES with the highest in-process throughput on a sample of texts."""
+        texts = list(texts)
+        if len(texts) > sample_size:
+            step = len(texts) / sample_size
+            texts = [texts[int(i * step)] for i in range(sample_size)]
+        best, best_rate = self.BATCH_SIZES[0], 0.0
+        for batch_size in self.BATCH_SIZES:
+            if batch_size > len(texts):
+                break
+            start = time.perf_counter()
+            self.model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+            rate = len(texts) / max(time.perf_counter() - start, 1e-9)
+            if rate > best_rate:
+                best, best_rate = batch_size, rate
+        logging.info(f'Tuned encoder batch size to {best} ({best_rate:.0f} texts/s in process)')
+        return best
+
+    def encode(self, texts: Sequence[str], **encode_kwargs) -> np.ndarray:
+        """Same result as SentenceTransformer.encode(texts); encode_kwargs other than batch_size are ignored."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        ordered = [texts[i] for i in order]
+        batch_size = encode_kwargs.get('batch_size') or self.batch_size
+        if batch_size is None:
+            if len(texts) >= self.min_pool_texts:
+                self.batch_size = batch_size = self.tune_batch_size(ordered)
+            else:
+                batch_size = 32
+        if len(texts) < self.min_pool_texts:
+            vectors = self.model.encode(ordered, batch_size=batch_size, show_progress_bar=False)
+        else:
+            # Contiguous chunks of the sorted texts go to the workers, so each chunk has a narrow length range.
+            chunk_size = max(batch_size, -(-len(texts) // (4 * self.processes)))
+            vectors = self.model.encode_multi_process(ordered, self._start(), batch_size=batch_size,
+                                                      chunk_size=chunk_size)
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result
+
+
+_registry = EncoderRegistry()
+_pools: Dict[Tuple[str, int], PooledEncoder] = {}
+_pools_lock = threading.Lock()
+
+
+def get_encoder(path: Optional[str] = None, device: Optional[str] = None) -> SentenceTransformer:
+    """The process-wide shared encoder for path and device (see resolve_encoder_path/resolve_encoder_device)."""
+    return _registry.get(path, device)
+
+
+def register_encoder(encoder, path: Optional[str] = None, device: Optional[str] = None):
+    _registry.register(encoder, path, device)
+
+
+def warm_up_encoder(path: Optional[str] = None, device: Optional[str] = None) -> SentenceTransformer:
+    return _registry.warm_up(path, device)
+
+
+def get_encoder_stats() -> Dict[str, object]:
+    return _registry.get_stats()
+
+
+def get_pooled_encoder(path: Optional[str] = None, processes: Optional[int] = None) -> PooledEncoder:
+    """The process-wide PooledEncoder for path with this many worker processes, stopped at exit."""
+    key = (resolve_encoder_path(path), processes or 0)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = PooledEncoder(key[0], processes)
+        return _pools[key]
+
+
+@atexit.register
+def _stop_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.stop()
@@ -0,0 +1,89 @@
+import math
+import re
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+class BM25Index():
+    """
+    In-memory inverted index with Okapi BM25 scoring, filled one batch of documents at a time.
+
+    Rows are numbered in insertion order, so an index filled alongside a RetrievalTable shares its row
+    numbers. Adding documents only appends to the postings of their terms; document frequencies and the
+    average length are read at query time, so nothing is rebuilt as the index grows.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._lengths: List[int] = []
+        self._lengths_array = np.zeros(0, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add_tokens(self, documents: Sequence[Sequence[str]]):
+        """Append already tokenized documents, so tokenization can happen outside the caller's lock."""
+        with self._lock:
+            for tokens in documents:
+                row = len(self._lengths)
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    rows, tfs = self._postings.setdefault(token, ([], []))
+                    rows.append(row)
+                    tfs.append(count)
+                self._lengths.append(len(tokens))
+
+    def add(self, texts: Sequence[str]):
+        self.add_tokens([self.tokenize(text) for text in texts])
+
+    def scores(self, query: str) -> np.ndarray:
+        """The BM25 score of every row for query; rows sharing no term with it score 0."""
+        terms = set(self.tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if len(self._lengths_array) != n:
+                self._lengths_array = np.asarray(self._lengths, dtype=np.float32)
+            lengths = self._lengths_array
+            postings = [(self._postings[term][0][:], self._postings[term][1][:])
+                        for term in terms if term in self._postings]
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0:
+            return scores
+        avg_length = max(float(lengths.mean()), 1.0)
+        for rows, tfs in postings:
+            rows = np.asarray(rows, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    @staticmethod
+    def top(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the top_k positive entries of scores, best first."""
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k > 0:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        return matched[np.argsort(-scores[matched], kind='stable')][:top_k]
+
+    def search(self, queries: List[str], top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """For each query, the (indices, scores) of its top_k matching rows, best first. Rows scoring 0 are left out."""
+        results = []
+        for query in queries:
+            scores = self.scores(query)
+            matched = self.top(scores, top_k)
+            results.append((matched, scores[matched]))
+        return results
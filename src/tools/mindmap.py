@@ -1,7 +1,14 @@
+import asyncio
 import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import logging
 import os
 import re
 import json
+import threading
+import time
 import dspy
 import sys
 import numpy as np
@@ -9,9 +16,12 @@ import networkx as nx
 import matplotlib.pyplot as plt
 from concurrent.futures import as_completed
 from typing import Union, List, Tuple, Optional, Dict
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from src.tools.encoder import get_encoder, resolve_encoder_path
+from src.tools.retrieval_table import RetrievalTable
+from src.tools.rm import SearchResultCache
 from src.utils.ArticleTextProcessing import ArticleTextProcessing
+from src.utils.EmbeddingCache import EmbeddingCache
+from src.utils.SnippetStore import SnippetStore
 
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,15 +33,20 @@ class ConceptGenerator(dspy.Module):
         super().__init__()
         self.lm = lm
         self.concept_generator = dspy.Predict(GenConcept)
+        self.batch_concept_generator = dspy.Predict(GenConceptBatch)
 
-    def forward(self, infos: List[Dict]):
+    @staticmethod
+    def _format_snippets(infos: List[Dict], word_limit: int = 3000) -> str:
         snippets_list = []
         for info in infos:
             snippet = info.get('snippets', [])
             snippets_list.extend(snippet)
         
         snippets_list_str = "\n".join(f"{index + 1}. {snippet}" for index, snippet in enumerate(snippets_list))
-        snippets_list_str = ArticleTextProcessing.limit_word_count_preserve_newline(snippets_list_str, 3000)
+        return ArticleTextProcessing.limit_word_count_preserve_newline(snippets_list_str, word_limit)
+
+    def forward(self, infos: List[Dict]):
+        snippets_list_str = self._format_snippets(infos)
 
         with dspy.settings.context(lm=self.lm):
             concepts = self.concept_generator(info=snippets_list_str).concepts
@@ -42,6 +57,50 @@ class ConceptGenerator(dspy.Module):
 
         return concept_list
 
+    def forward_parallel(self, infos_by_category: Dict[str, List[Dict]], max_thread_num: int = 4) -> Dict[str, List[str]]:
+        """Run forward for every category concurrently, one LLM request per category."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_thread_num) as executor:
+            concept_lists = list(executor.map(self.forward, infos_by_category.values()))
+        return dict(zip(infos_by_category, concept_lists))
+
+    def _forward_one_batch(self, categories: List[str], infos_by_category: Dict[str, List[Dict]]) -> Dict[str, List[str]]:
+        info = "\n\n".join(f"[{index + 1}] {category}\n{self._format_snippets(infos_by_category[category])}"
+                            for index, category in enumerate(categories))
+
+        with dspy.settings.context(lm=self.lm):
+            concepts = self.batch_concept_generator(info=info).concepts
+
+        concepts_by_index = {}
+        current_index = None
+        for line in concepts.split('\n'):
+            header = re.match(r"^[\s#*-]*\[(\d+)\]", line)
+            if header:
+                current_index = int(header.group(1)) - 1
+                concepts_by_index.setdefault(current_index, [])
+            elif current_index is not None:
+                concepts_by_index[current_index].extend(match.strip() for match in re.findall(r"\d+\.\s*(.*)", line))
+        return {categories[index]: concept_list for index, concept_list in concepts_by_index.items()
+                if 0 <= index < len(categories)}
+
+    def forward_batch(self, infos_by_category: Dict[str, List[Dict]], batch_size: int = 4,
+                      max_thread_num: int = 4) -> Dict[str, List[str]]:
+        """
+        Generate the concepts of several categories with one LLM request per batch of batch_size categories.
+        Each category's snippets are listed under a numbered "[i] category" header and the answer is split back
+        on the same headers. Categories that are missing or empty in the answer fall back to forward.
+        """
+        categories = list(infos_by_category)
+        batches = [categories[i:i + batch_size] for i in range(0, len(categories), batch_size)]
+        concepts = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_thread_num) as executor:
+            for batch_concepts in executor.map(lambda batch: self._forward_one_batch(batch, infos_by_category), batches):
+                concepts.update(batch_concepts)
+
+        for category in categories:
+            if not concepts.get(category):
+                concepts[category] = self.forward(infos_by_category[category])
+        return {category: concepts[category] for category in categories}
+
 class ExtendConcept(dspy.Signature):
     """You are an analytical robot. I will provide you with a subject, the information I have searched about it, and our preliminary concept of it. I need you to generate a detailed, in-depth, and insightful report based on it, further exploring our initial ideas. 
 
@@ -70,24 +129,85 @@ Present your comprehensive opinion in the format of 1. 2. ..."""
     concepts = dspy.OutputField(format=str)
 
 
+class GenConceptBatch(dspy.Signature):
+    """Please analyze, summarize, and evaluate the following webpage information, which is grouped into several categories. Each category starts with a header of the form [1] Category name.
+Think like a person, distill the core point of each piece of information, and synthesize them into a comprehensive opinion for each category separately.
+Repeat each category header on its own line, exactly as given, and present the comprehensive opinion of that category under it in the format of 1. 2. ..."""
+    info = dspy.InputField(prefix='The webpage information you have collected, grouped by category:', format=str)
+    concepts = dspy.OutputField(format=str)
+
+
+class MindMapContext():
+    """
+    Handles shared by every MindPoint of one map: the LM, the retriever, the branch pruner, the
+    snippet store and the DSPy modules built on them. Nodes only keep a reference to this object.
+    """
+    CONCEPT_MODES = ('sequential', 'parallel', 'batch')
+
+    def __init__(self, lm: Union[dspy.dsp.LM, dspy.dsp.HFModel], retriever, pruner: Optional['BranchPruner'] = None,
+                 store: Optional[SnippetStore] = None, concept_mode: str = 'sequential', concept_batch_size: int = 4):
+        if concept_mode not in self.CONCEPT_MODES:
+            raise ValueError(f"concept_mode must be one of {self.CONCEPT_MODES}, got {concept_mode!r}")
+        self.concept_mode = concept_mode
+        self.concept_batch_size = concept_batch_size
+        self.lm = lm
+        self.retriever = retriever
+        self.pruner = pruner
+        self.store = store if store is not None else SnippetStore()
+        self.concept_generator = ConceptGenerator(lm=lm)
+        self.extend_concept = dspy.Predict(ExtendConcept)
+
+
 class MindPoint():
-    def __init__(self, retriever, lm: Union[dspy.dsp.LM, dspy.dsp.HFModel], root: bool = False,
-                 children: Optional[List['MindPoint']] = None, concept: str = '',
-                 info: Optional[List[Dict]] = None, category: str = ''):
+    __slots__ = ('root', 'category', 'keywords', 'concept', 'children', 'refs', 'context')
+
+    def __init__(self, context: MindMapContext, root: bool = False,
+                 children: Optional[Dict[str, 'MindPoint']] = None, concept: str = '',
+                 info: Optional[List[Dict]] = None, category: str = '', keywords: Tuple[str, ...] = ()):
         self.root = root
         self.category = category
+        # The search keywords the node was expanded from, kept so the pruner can index restored nodes alike.
+        self.keywords = tuple(keywords)
         self.children = children if children is not None else {}
         self.concept = concept
+        self.context = context
         self.info = info if info is not None else []
-        self.lm = lm
-        self.retriever = retriever
-        self.concept_generator = ConceptGenerator(lm=lm)
-    
-    def extend(self):
-        extend_concept = dspy.Predict(ExtendConcept)
+
+    @property
+    def lm(self):
+        return self.context.lm
+
+    @property
+    def retriever(self):
+        return self.context.retriever
+
+    @property
+    def pruner(self) -> Optional['BranchPruner']:
+        return self.context.pruner
+
+    @property
+    def concept_generator(self) -> ConceptGenerator:
+        return self.context.concept_generator
+
+    @property
+    def info(self) -> List[Dict]:
+        """The node's search results, rebuilt from its (url, snippet IDs, metadata) references in the snippet store."""
+        return [self.context.store.get_info(url, snippet_ids, metadata) for url, snippet_ids, metadata in self.refs]
+
+    @info.setter
+    def info(self, info: List[Dict]):
+        self.refs = tuple(self.context.store.add_info(i) for i in info)
+
+    def _is_duplicate_branch(self, category: str, keywords_list: List[str]) -> bool:
+        return self.pruner is not None and self.pruner.is_duplicate(category, keywords_list, parent=self.category)
+
+    def _generate_keywords(self) -> str:
         with dspy.settings.context(lm=self.lm):
-            info='\n'.join([str(i) for i in self.info])
-            keywords = extend_concept(info='\n'.join([str(i) for i in self.info]), concept=self.concept, category = self.category).keywords
+            keywords = self.context.extend_concept(info='\n'.join([str(i) for i in self.info]), concept=self.concept, category = self.category).keywords
+        return keywords
+
+    @staticmethod
+    def _parse_categories(keywords: str) -> Dict[str, List[str]]:
         categories = {}
         current_category = None
         for line in keywords.split('\n'):
@@ -99,12 +219,316 @@ class MindPoint():
                 keyword = line[3:-1].strip()
                 if keyword:
                     categories[current_category].append(keyword)
+        return categories
+
+    def _expand_category(self, category: str, keywords_list: List[str]) -> 'MindPoint':
+        new_info = self.retriever(keywords_list)
+        new_concept = self.concept_generator.forward(new_info)
+        new_node = MindPoint(self.context, concept=new_concept, info=new_info, category=category,
+                             keywords=keywords_list)
+        self.children[category] = new_node
+        return new_node
+
+    def _generate_concepts(self, infos_by_category: Dict[str, List[Dict]],
+                           max_thread_num: int = 4) -> Dict[str, List[str]]:
+        if self.context.concept_mode == 'batch':
+            return self.concept_generator.forward_batch(infos_by_category, batch_size=self.context.concept_batch_size,
+                                                        max_thread_num=max_thread_num)
+        if self.context.concept_mode == 'parallel':
+            return self.concept_generator.forward_parallel(infos_by_category, max_thread_num=max_thread_num)
+        return {category: self.concept_generator.forward(infos) for category, infos in infos_by_category.items()}
+
+    @contextlib.contextmanager
+    def _release_on_failure(self, categories: Dict[str, List[str]]):
+        try:
+            yield
+        except Exception:
+            # The children of a failed extend are dropped, so its categories must not prune later branches.
+            if self.pruner is not None:
+                self.pruner.remove(categories)
+            raise
+
+    def extend(self):
+        categories = {category: keywords_list
+                      for category, keywords_list in self._parse_categories(self._generate_keywords()).items()
+                      if not self._is_duplicate_branch(category, keywords_list)}
+
+        with self._release_on_failure(categories):
+            if self.context.concept_mode == 'sequential':
+                for category, keywords_list in categories.items():
+                    self._expand_category(category, keywords_list)
+                return
+
+            # Search every category first, then summarize them together instead of one LLM round trip per category.
+            infos_by_category = {category: self.retriever(keywords_list)
+                                 for category, keywords_list in categories.items()}
+            concepts = self._generate_concepts(infos_by_category)
+            for category, new_info in infos_by_category.items():
+                self.children[category] = MindPoint(self.context, concept=concepts[category], info=new_info,
+                                                    category=category, keywords=categories[category])
+
+    async def aextend(self, search_limit: asyncio.Semaphore, llm_limit: asyncio.Semaphore,
+                      executor: Optional[concurrent.futures.Executor] = None):
+        """
+        Coroutine version of extend. The blocking search and LLM calls run in the threads of executor
+        (the event loop's default executor if None), each gated by its own semaphore, so that all
+        categories of a node (and all nodes of a level) overlap their network I/O. Children are inserted
+        in category order, exactly as extend does.
+        """
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args):
+            return loop.run_in_executor(executor, func, *args)
+
+        async with llm_limit:
+            keywords = await run(self._generate_keywords)
+        categories = self._parse_categories(keywords)
+        if self.pruner is not None:
+            categories = {c: k for c, k in categories.items()
+                          if not await run(self._is_duplicate_branch, c, k)}
+
+        async def search(keywords_list: List[str]) -> List[Dict]:
+            async with search_limit:
+                return await run(self.retriever, keywords_list)
+
+        async def expand(category: str, keywords_list: List[str]) -> 'MindPoint':
+            new_info = await search(keywords_list)
+            async with llm_limit:
+                new_concept = await run(self.concept_generator.forward, new_info)
+            return MindPoint(self.context, concept=new_concept, info=new_info, category=category,
+                             keywords=keywords_list)
+
+        with self._release_on_failure(categories):
+            if self.context.concept_mode == 'batch':
+                new_infos = await asyncio.gather(*(search(k) for k in categories.values()))
+                infos_by_category = dict(zip(categories, new_infos))
+                async with llm_limit:
+                    # One request at a time, so a single llm_limit permit covers one LLM call.
+                    concepts = await run(self._generate_concepts, infos_by_category, 1)
+                new_nodes = [MindPoint(self.context, concept=concepts[c], info=infos_by_category[c], category=c,
+                                       keywords=categories[c]) for c in categories]
+            else:
+                # Categories already overlap here, so 'parallel' needs nothing extra.
+                new_nodes = await asyncio.gather(*(expand(c, k) for c, k in categories.items()))
+            for category, new_node in zip(categories, new_nodes):
+                self.children[category] = new_node
+
+
+class BranchPruner():
+    """
+    Index of the categories already in a mind map, used to skip proposed branches that are
+    near-duplicates of an existing one. Each category is embedded together with its search keywords
+    and compared by cosine similarity with every category indexed so far.
+    """
+    def __init__(self, encoder, threshold: float = 0.85):
+        """
+        Args:
+            encoder: A SentenceTransformer (or anything with the same encode method).
+            threshold: Branches at or above this similarity to an indexed category are skipped.
+        """
+        self.encoder = encoder
+        self.threshold = threshold
+        self._categories = []
+        self._vectors = []
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.pruned_branches = []
+
+    def _embed(self, category: str, keywords_list: List[str]) -> np.ndarray:
+        vector = np.asarray(self.encoder.encode(f"{category}: {'; '.join(keywords_list)}", show_progress_bar=False),
+                            dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def add(self, category: str, keywords_list: List[str] = ()):
+        vector = self._embed(category, list(keywords_list))
+        with self._lock:
+            self._categories.append(category)
+            self._vectors.append(vector)
+
+    def is_duplicate(self, category: str, keywords_list: List[str], parent: str = '') -> bool:
+        """
+        Return True if the branch duplicates an indexed category. Otherwise index it and return False,
+        so that concurrent siblings proposing the same branch are pruned as well.
+        """
+        vector = self._embed(category, keywords_list)
+        with self._lock:
+            self.checked += 1
+            if self._vectors:
+                similarities = np.stack(self._vectors) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.pruned_branches.append({'parent': parent, 'category': category,
+                                                 'duplicate_of': self._categories[best],
+                                                 'similarity': float(similarities[best])})
+                    return True
+            self._categories.append(category)
+            self._vectors.append(vector)
+            return False
+
+    def remove(self, categories):
+        """Unindex categories added by is_duplicate, e.g. when the extend that proposed them failed."""
+        with self._lock:
+            for category in categories:
+                for i in range(len(self._categories) - 1, -1, -1):
+                    if self._categories[i] == category:
+                        del self._categories[i]
+                        del self._vectors[i]
+                        break
+
+    def clear(self):
+        """Forget every indexed category, e.g. before building or loading another map."""
+        with self._lock:
+            self._categories = []
+            self._vectors = []
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {'checked': self.checked, 'avoided_expansions': len(self.pruned_branches)}
+
+
+class MindMapCheckpoint():
+    """
+    Append-only JSON Lines log of the MindPoints completed by MindMap.build_map.
+
+    Two kinds of records are written, where path lists the categories from the root (the topic)
+    down to the node:
+        {"type": "node", "path": [...], "keywords": [...], "concept": [...], "info": [...]}   one per MindPoint
+        {"type": "extended", "path": [...]}   once every child of the node at path is logged
+    Each extend is flushed and fsynced as one write, so a crash loses at most the extends in flight.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._paths = {}
+        self._extended = set()
+        self._file = None
+
+    @staticmethod
+    def _node_record(node: MindPoint, path: List[str]) -> Dict:
+        return {'type': 'node', 'path': path, 'keywords': list(node.keywords), 'concept': node.concept,
+                'info': node.info}
+
+    def _write(self, records: List[Dict]):
+        self._file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def is_extended(self, node: MindPoint) -> bool:
+        path = self._paths.get(id(node))
+        return path is not None and tuple(path) in self._extended
+
+    def start(self, root: MindPoint):
+        """Start a new checkpoint with the root, discarding whatever the file held."""
+        self._paths = {id(root): [root.category]}
+        self._extended = set()
+        self._file = open(self.filename, 'w', encoding='utf-8')
+        self._write([self._node_record(root, [root.category])])
+
+    def record_extend(self, node: MindPoint):
+        path = self._paths[id(node)]
+        records = []
+        for category, child in node.children.items():
+            self._paths[id(child)] = path + [category]
+            records.append(self._node_record(child, path + [category]))
+        records.append({'type': 'extended', 'path': path})
+        self._extended.add(tuple(path))
+        self._write(records)
+
+    def resume(self, topic: str, restore_node) -> Optional[MindPoint]:
+        """
+        Rebuild the tree logged for the topic, creating each node with restore_node(path, record).
+        Children of an extend that was not completely logged are dropped, so that extend is redone.
+        The file is rewritten with the kept records only. Returns the root, or None if the file
+        holds no checkpoint for this topic.
+        """
+        if not os.path.exists(self.filename):
+            return None
+        records = []
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # A torn last line left by a crash.
+        if not records or records[0]['type'] != 'node' or records[0]['path'] != [topic]:
+            return None
+
+        extended = {tuple(record['path']) for record in records if record['type'] == 'extended'}
+        nodes = {}
+        kept = []
+        for record in records:
+            path = tuple(record['path'])
+            if record['type'] == 'extended':
+                if path in nodes:
+                    kept.append(record)
+                continue
+            if len(path) > 1 and (path[:-1] not in nodes or path[:-1] not in extended):
+                continue
+            node = restore_node(list(path), record)
+            if len(path) > 1:
+                nodes[path[:-1]].children[path[-1]] = node
+            nodes[path] = node
+            self._paths[id(node)] = list(path)
+            kept.append(record)
+        self._extended = {path for path in extended if path in nodes}
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in kept))
+        os.replace(tmp_filename, self.filename)
+        self._file = open(self.filename, 'a', encoding='utf-8')
+        return nodes[(topic,)]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _lm_tokens(lm) -> Optional[int]:
+    """Total tokens reported by the LM wrappers in src/tools/lm.py, or None if the LM does not count them."""
+    if hasattr(lm, 'prompt_tokens') and hasattr(lm, 'completion_tokens'):
+        return lm.prompt_tokens + lm.completion_tokens
+    return None
+
+
+def _estimate_tokens(*texts) -> int:
+    return sum(len(str(text)) for text in texts) // 4
 
-        for category, keywords_list in categories.items():
-            new_info = self.retriever(keywords_list)
-            new_concept = self.concept_generator.forward(new_info)
-            new_node = MindPoint(concept=new_concept, info=new_info, lm=self.lm, retriever=self.retriever, category=category)
-            self.children[category] = new_node
+
+class ExplorationBudget():
+    """
+    Spending limits for MindMap.explore_map. Limits left as None are not enforced.
+
+    Args:
+        max_tokens: LLM tokens (prompt + completion). Taken from the LM's own counters when it keeps
+            them, otherwise estimated as 4 characters per token.
+        max_queries: Search queries sent to the search engine (cache hits are free).
+        max_seconds: Wall-clock seconds since exploration started.
+    """
+    def __init__(self, max_tokens: Optional[int] = None, max_queries: Optional[int] = None,
+                 max_seconds: Optional[float] = None):
+        self.max_tokens = max_tokens
+        self.max_queries = max_queries
+        self.max_seconds = max_seconds
+        self.tokens = 0
+        self.queries = 0
+        self.start_time = time.monotonic()
+
+    def start(self):
+        self.tokens = 0
+        self.queries = 0
+        self.start_time = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def exhausted(self) -> bool:
+        return ((self.max_tokens is not None and self.tokens >= self.max_tokens)
+                or (self.max_queries is not None and self.queries >= self.max_queries)
+                or (self.max_seconds is not None and self.elapsed() >= self.max_seconds))
+
+    def spent(self) -> Dict[str, float]:
+        return {'tokens': self.tokens, 'queries': self.queries, 'seconds': self.elapsed()}
 
 
 class MindMap():
@@ -112,22 +536,152 @@ class MindMap():
                  retriever, 
                  gen_concept_lm: Union[dspy.dsp.LM, dspy.dsp.HFModel],
                  depth: int,
-                 workers: int = 5
+                 workers: int = 5,
+                 search_cache: bool = True,
+                 prune_threshold: Optional[float] = None,
+                 concept_mode: str = 'sequential',
+                 concept_batch_size: int = 4,
+                 incremental_table: bool = True,
+                 index_backend: str = 'exact',
+                 index_params: Optional[Dict] = None,
+                 embedding_cache_dir: Optional[str] = None,
+                 retrieval_fusion: Optional[str] = None,
+                 fusion_dense_weight: float = 0.5,
+                 table_storage: str = 'float32',
+                 table_pca_dim: Optional[int] = None,
+                 encode_processes: Optional[int] = None,
+                 mmr_lambda: Optional[float] = None,
+                 max_snippets_per_url: Optional[int] = None
                  ):
-        self.retriever = retriever
+        """
+        Args:
+            search_cache: If True, wrap the retriever in a SearchResultCache shared by every node of
+                the map, so repeated keywords are searched once. Hit rates are available from
+                self.search_cache.get_stats().
+            prune_threshold: If set, skip proposed branches whose category and keywords are at least this
+                similar to a category already in the map. Avoided expansions are reported by
+                self.pruner.get_stats().
+            concept_mode: How MindPoint.extend summarizes the snippets of its new categories:
+                'sequential' (one LLM request after another), 'parallel' (concurrent requests) or
+                'batch' (concept_batch_size categories per request, see ConceptGenerator.forward_batch).
+            incremental_table: If True, snippets are encoded into the retrieval table in the background
+                as MindPoints are added, so prepare_table_for_retrieval only waits for the last batch.
+                Maps read by load_map are encoded when prepare_table_for_retrieval is first called.
+            index_backend, index_params: Nearest-neighbour index of the retrieval table: 'exact', 'hnsw' or
+                'ivfpq' with the backend's recall/latency parameters (see RetrievalTable).
+            embedding_cache_dir: If set, snippet embeddings are cached on disk here (see EmbeddingCache) and
+                reused by later runs instead of being encoded again.
+            retrieval_fusion: If 'rrf' or 'weighted', the retrieval table also keeps a BM25 index and
+                retrieve_information fuses the lexical and dense rankings (see RetrievalTable.hybrid_search),
+                which ranks short heading-like queries better. None keeps retrieval dense-only.
+            fusion_dense_weight: Weight of the dense score under 'weighted' fusion.
+            table_storage, table_pca_dim: Precision ('float32', 'float16' or 'int8') and optional PCA
+                dimension of the retrieval table's embeddings (see RetrievalTable); the memory saved is
+                reported by self.table.get_storage_stats().
+            encode_processes: If set, snippets are encoded by this many CPU worker processes
+                (see encoder.PooledEncoder) instead of the calling process.
+            mmr_lambda: If set, retrieve_information re-ranks a deeper candidate list by maximal marginal
+                relevance (see RetrievalTable.mmr_rerank), trading relevance (1.0) for diversity (0.0), so
+                near-duplicate snippets do not crowd out distinct ones.
+            max_snippets_per_url: Maximum number of snippets of one URL returned per query.
+        """
+        if retrieval_fusion not in (None, 'rrf', 'weighted'):
+            raise ValueError(f"retrieval_fusion must be None, 'rrf' or 'weighted', got {retrieval_fusion!r}")
+        self.pruner = BranchPruner(get_encoder(), prune_threshold) if prune_threshold is not None else None
+        self.search_cache = SearchResultCache(retriever) if search_cache else None
+        self.retriever = self.search_cache if search_cache else retriever
         self.gen_concept_lm = gen_concept_lm
         self.depth = depth
-        self.concept_generator = ConceptGenerator(lm=self.gen_concept_lm)
+        self.incremental_table = incremental_table
+        self.retrieval_fusion = retrieval_fusion
+        self.fusion_dense_weight = fusion_dense_weight
+        self.mmr_lambda = mmr_lambda
+        self.max_snippets_per_url = max_snippets_per_url
+        self.table_options = {
+            'index_backend': index_backend,
+            'index_params': index_params,
+            'embedding_cache': EmbeddingCache(embedding_cache_dir, resolve_encoder_path()) if embedding_cache_dir else None,
+            'lexical_index': retrieval_fusion is not None,
+            'storage': table_storage,
+            'pca_dim': table_pca_dim,
+            'encode_processes': encode_processes,
+        }
+        self.context = MindMapContext(lm=self.gen_concept_lm, retriever=self.retriever, pruner=self.pruner,
+                                      concept_mode=concept_mode, concept_batch_size=concept_batch_size)
+        self._reset_store()
+        self.concept_generator = self.context.concept_generator
         self.root = None
         self.max_workers = workers
         print('MindMap initialized')
 
-    def build_map(self, topic: str):
-        root_info = self.retriever(topic)
-        root_concept = self.concept_generator(root_info)
-        root = MindPoint(root=True, info=root_info, concept=root_concept, lm=self.gen_concept_lm, retriever=self.retriever, category=topic)
+    def _reset_store(self, attach_table: bool = True):
+        self.store = SnippetStore()
+        self.context.store = self.store
+        if self.pruner is not None:
+            self.pruner.clear()
+        self.table = None
+        if self.incremental_table and attach_table:
+            self._attach_table()
+
+    def _attach_table(self):
+        self.table = RetrievalTable(self.store, **self.table_options)
+        self.store.add_listener(self.table.add_page)
+
+    def _make_root(self, topic: str, root_info: List[Dict], root_concept: List[str]) -> MindPoint:
+        self._reset_store()
+        root = MindPoint(self.context, root=True, info=root_info, concept=root_concept, category=topic)
         self.root = root
-        
+        if self.pruner is not None:
+            self.pruner.add(topic)
+        return root
+
+    def _restore_node(self, path: List[str], record: Dict) -> MindPoint:
+        keywords = record.get('keywords', [])
+        node = MindPoint(self.context, root=len(path) == 1, info=record['info'], concept=record['concept'],
+                         category=path[-1], keywords=keywords)
+        if self.pruner is not None:
+            self.pruner.add(path[-1], keywords)
+        return node
+
+    def build_map(self, topic: str, pipelined: bool = False, checkpoint_path: Optional[str] = None,
+                  resume: bool = False):
+        """
+        Build the mind map for the topic, yielding the nodes as they are produced.
+
+        Args:
+            topic: The topic of the root MindPoint.
+            pipelined: If False, expand the map level by level (a level starts once the previous one
+                has finished). If True, every child starts expanding as soon as its parent's extend
+                returns, using up to `workers` threads, and each yielded list holds the children of
+                one finished node.
+            checkpoint_path: If set, every completed MindPoint is appended to this JSON Lines file as
+                soon as its parent's extend returns (see MindMapCheckpoint).
+            resume: If True and checkpoint_path holds a checkpoint for the same topic, rebuild the
+                partial tree from it and only extend the nodes that were not extended yet.
+        """
+        checkpoint = MindMapCheckpoint(checkpoint_path) if checkpoint_path else None
+        if checkpoint is not None and resume:
+            self._reset_store()
+        root = checkpoint.resume(topic, self._restore_node) if checkpoint is not None and resume else None
+        if root is not None:
+            self.root = root
+        else:
+            root_info = self.retriever(topic)
+            root_concept = self.concept_generator(root_info)
+            root = self._make_root(topic, root_info, root_concept)
+            if checkpoint is not None:
+                checkpoint.start(root)
+
+        try:
+            if pipelined:
+                yield from self._build_map_pipelined(root, checkpoint)
+            else:
+                yield from self._build_map_by_level(root, checkpoint)
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def _build_map_by_level(self, root: MindPoint, checkpoint: Optional['MindMapCheckpoint'] = None):
         current_level = [root]
         
         for count in range(self.depth):
@@ -138,16 +692,192 @@ class MindMap():
                 break
             
             with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                futures = {executor.submit(node.extend): node for node in current_level}
+                futures = {}
+                for node in current_level:
+                    if checkpoint is not None and checkpoint.is_extended(node):
+                        next_level.extend(node.children.values())
+                    else:
+                        futures[executor.submit(node.extend)] = node
                 
                 for future in concurrent.futures.as_completed(futures):
                     node = futures[future]
+                    if future.exception() is not None:
+                        logging.error(f'Error occurs when extending {node.category}: {future.exception()}')
+                        # Children added before the failure were never logged, so the extend is left undone.
+                        node.children = {}
+                        continue
+                    if checkpoint is not None:
+                        checkpoint.record_extend(node)
                     # Assuming extend populates children.
                     next_level.extend(node.children.values())
             
             yield current_level
             current_level = next_level
-    
+
+    def _build_map_pipelined(self, root: MindPoint, checkpoint: Optional['MindMapCheckpoint'] = None):
+        yield [root]
+        if self.depth <= 1:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Maps each running extend to its node and the node's level (root is level 0).
+            futures = {}
+            # Nodes restored from a checkpoint are walked first; only their unexpanded frontier is submitted.
+            stack = [(root, 0)]
+            while stack:
+                node, level = stack.pop()
+                if checkpoint is not None and checkpoint.is_extended(node):
+                    children = list(node.children.values())
+                    if level + 1 < self.depth - 1:
+                        stack.extend((child, level + 1) for child in children)
+                    if children:
+                        yield children
+                else:
+                    futures[executor.submit(node.extend)] = (node, level)
+
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    node, level = futures.pop(future)
+                    if future.exception() is not None:
+                        logging.error(f'Error occurs when extending {node.category}: {future.exception()}')
+                        node.children = {}
+                        continue
+                    if checkpoint is not None:
+                        checkpoint.record_extend(node)
+                    children = list(node.children.values())
+                    # Nodes on the last layer (level depth - 1) are not extended, as in level mode.
+                    if level + 1 < self.depth - 1:
+                        for child in children:
+                            futures[executor.submit(child.extend)] = (child, level + 1)
+                    if children:
+                        yield children
+
+    def explore_map(self, topic: str, budget: ExplorationBudget, max_depth: Optional[int] = None,
+                    weights: Tuple[float, float, float] = (1.0, 1.0, 0.5)):
+        """
+        Best-first alternative to build_map. Candidate MindPoints wait in a priority queue and the most
+        promising one is extended next, one category at a time, until the budget runs out.
+
+        A candidate's score is the weighted sum of:
+            - new-URL yield: share of its URLs that no earlier node had found,
+            - snippet novelty: share of its snippets that no earlier node had found,
+            - concept richness: number of concepts it produced, capped at 10 and scaled to [0, 1].
+
+        Args:
+            topic: The topic of the root MindPoint.
+            budget: The ExplorationBudget to spend. Its counters are reset at the start.
+            max_depth: Optional cap on the node level (root is level 0) that may still be extended.
+            weights: Weights of (new-URL yield, snippet novelty, concept richness).
+
+        Yields the children of each extended node as they are created. The spending is kept in
+        self.exploration_stats.
+        """
+        budget.start()
+        seen_urls = set()
+        seen_snippets = set()
+        counter = itertools.count()
+        candidates = []
+
+        def spend(lm_texts, queries: int, step):
+            tokens_before = _lm_tokens(self.gen_concept_lm)
+            queries_before = self.search_cache.misses if self.search_cache else None
+            result = step()
+            tokens_after = _lm_tokens(self.gen_concept_lm)
+            if tokens_before is not None and tokens_after is not None and tokens_after >= tokens_before:
+                budget.tokens += tokens_after - tokens_before
+            else:
+                budget.tokens += _estimate_tokens(*lm_texts(result))
+            budget.queries += self.search_cache.misses - queries_before if self.search_cache else queries
+            return result
+
+        def push(node: MindPoint, level: int):
+            urls = [url for url, _, _ in node.refs]
+            snippets = [snippet_id for _, snippet_ids, _ in node.refs for snippet_id in snippet_ids]
+            url_yield = sum(url not in seen_urls for url in urls) / len(urls) if urls else 0.0
+            novelty = sum(snippet not in seen_snippets for snippet in snippets) / len(snippets) if snippets else 0.0
+            richness = min(len(node.concept), 10) / 10
+            seen_urls.update(urls)
+            seen_snippets.update(snippets)
+            score = weights[0] * url_yield + weights[1] * novelty + weights[2] * richness
+            if max_depth is None or level < max_depth:
+                heapq.heappush(candidates, (-score, next(counter), level, node))
+
+        root_info = spend(lambda result: [], 1, lambda: self.retriever(topic))
+        root_concept = spend(lambda result: [root_info, result], 0, lambda: self.concept_generator(root_info))
+        root = self._make_root(topic, root_info, root_concept)
+        push(root, 0)
+        yield [root]
+
+        expanded = 0
+        while candidates and not budget.exhausted():
+            _, _, level, node = heapq.heappop(candidates)
+            keywords = spend(lambda result: [node.info, node.concept, result], 0, node._generate_keywords)
+            expanded += 1
+            new_nodes = []
+            for category, keywords_list in node._parse_categories(keywords).items():
+                if budget.exhausted():
+                    break
+                if node._is_duplicate_branch(category, keywords_list):
+                    continue
+                new_node = spend(lambda result: [result.info, result.concept], len(keywords_list),
+                                 lambda: node._expand_category(category, keywords_list))
+                push(new_node, level + 1)
+                new_nodes.append(new_node)
+            if new_nodes:
+                yield new_nodes
+
+        self.exploration_stats = {**budget.spent(), 'expanded_nodes': expanded, 'pending_candidates': len(candidates)}
+
+    async def abuild_map(self, topic: str, search_concurrency: int = 5, llm_concurrency: int = 5):
+        """
+        Asyncio version of build_map. Every search and concept LLM call is awaited as a coroutine,
+        with search_concurrency and llm_concurrency bounding the number of requests in flight
+        across the whole map. Yields the same levels and builds the same MindPoint tree as build_map.
+
+        The blocking calls run on a thread pool of search_concurrency + llm_concurrency threads owned by
+        this call, so both limits take effect whatever the size of the event loop's default executor.
+
+        Usage:
+            async for layer in mind_map.abuild_map(topic):
+                ...
+        """
+        search_limit = asyncio.Semaphore(search_concurrency)
+        llm_limit = asyncio.Semaphore(llm_concurrency)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=search_concurrency + llm_concurrency)
+        loop = asyncio.get_running_loop()
+
+        try:
+            async with search_limit:
+                root_info = await loop.run_in_executor(executor, self.retriever, topic)
+            async with llm_limit:
+                root_concept = await loop.run_in_executor(executor, self.concept_generator, root_info)
+            root = self._make_root(topic, root_info, root_concept)
+
+            current_level = [root]
+
+            for count in range(self.depth):
+                next_level = []
+
+                yield current_level
+                if count == self.depth - 1:  # Check if it's the last layer
+                    break
+
+                results = await asyncio.gather(*(node.aextend(search_limit, llm_limit, executor)
+                                                 for node in current_level), return_exceptions=True)
+                for node, result in zip(current_level, results):
+                    if isinstance(result, Exception):
+                        # As in build_map, a failed extend leaves its node a leaf and the rest of the map is built.
+                        logging.error(f'Error occurs when extending {node.category}: {result}')
+                        node.children = {}
+                        continue
+                    next_level.extend(node.children.values())
+
+                yield current_level
+                current_level = next_level
+        finally:
+            executor.shutdown(wait=False)
+
     def recursive_extend(self, node: MindPoint, count: int):
         if count >= self.depth:
             return
@@ -159,6 +889,7 @@ class MindMap():
         def serialize_node(node: MindPoint):
             return {
                 'category': node.category,
+                'keywords': list(node.keywords),
                 'concept': node.concept,
                 'children': {k: serialize_node(v) for k, v in node.children.items()},
                 'info':node.info,
@@ -175,13 +906,18 @@ class MindMap():
             info = node_data['info']
             children_data = node_data['children']
 
-            node = MindPoint(concept=concept, info=info, lm=self.gen_concept_lm, retriever=self.retriever, category=category)
+            keywords = node_data.get('keywords', [])
+            node = MindPoint(self.context, concept=concept, info=info, category=category, keywords=keywords)
+            if self.pruner is not None:
+                self.pruner.add(category, keywords)
             node.children = {k: deserialize_node(v) for k, v in children_data.items()}
             return node
         
         with open(filename, 'r', encoding='utf-8') as f:
             mind_map_dict = json.load(f)
         
+        # A loaded map has no build to overlap encoding with, so the table waits for prepare_table_for_retrieval.
+        self._reset_store(attach_table=False)
         self.root = deserialize_node(mind_map_dict)
         return self.root
 
@@ -203,72 +939,87 @@ class MindMap():
         """
         Get all unique info from the MindMap, ensuring unique URLs.
         """
-        all_infos = []
-        seen_urls = set()
-
-        def traverse(node: MindPoint):
-            if node.info:
-                for info in node.info:
-                    url = info.get('url')
-                    if url and url not in seen_urls:
-                        seen_urls.add(url)
-                        all_infos.append(info)
-            for child in node.children.values():
-                traverse(child)
-
-        traverse(self.root)
+        all_infos = [self.store.get_info(url, snippet_ids) for url, snippet_ids in self.store.iter_pages()]
         self.all_infos = all_infos
         return all_infos
 
+    @property
+    def collected_snippets(self) -> List[str]:
+        return self.store.get_snippets(self.collected_snippet_ids)
+
     def prepare_table_for_retrieval(self):
         """
         Prepare collected snippets and URLs for retrieval by encoding the snippets using paraphrase-MiniLM-L6-v2.
-        collected_urls and collected_snippets have corresponding indices.
-        """
-        self.encoder = SentenceTransformer('/mnt/nas-alinlp/xizekun/huggingface_cache/all-MiniLM-L6-v2')
-        self.collected_urls = []
-        self.collected_snippets = []
-        seen_urls = set()
-
-        for info in self.get_all_infos():
-            url = info.get('url')
-            snippets = info.get('snippets', [])
-            if url and url not in seen_urls:
-                seen_urls.add(url)
-                for snippet in snippets:
-                    self.collected_urls.append(url)
-                    self.collected_snippets.append(snippet)
+        collected_urls and collected_snippet_ids have corresponding indices; the snippet texts live in self.store.
 
-        self.encoded_snippets = self.encoder.encode(self.collected_snippets, show_progress_bar=True)
+        The snippets are encoded by self.table, which is filled while the map is built when incremental_table
+        is set, so this only waits for the batches still in flight. Calling it again costs nothing.
+        """
+        if self.table is None:
+            self._attach_table()
+        self.table.flush()
+        self.encoder = self.table.encoder
+        self.collected_urls = self.table.urls
+        self.collected_snippet_ids = self.table.snippet_ids
+        # With compact storage, keep the compact rows rather than a dequantized float32 copy.
+        self.encoded_snippets = self.table.embeddings if self.table.compact is None else self.table.compact
 
     def retrieve_information(self, queries: Union[List[str], str], search_top_k) -> List[Dict[str, any]]:
         """
         Retrieve relevant information based on the given queries.
-        Returns a list of dictionaries containing 'url' and 'snippets'.
+        Returns a list of dictionaries containing 'url', 'snippets' and the matching 'snippet_ids' in self.store.
         """
-        selected_urls = []
-        selected_snippets = []
         if type(queries) is str:
             queries = [queries]
-        for query in queries:
-            encoded_query = self.encoder.encode(query, show_progress_bar=False)
-            sim = cosine_similarity([encoded_query], self.encoded_snippets)[0]
-            sorted_indices = np.argsort(sim)
-            for i in sorted_indices[-search_top_k:][::-1]:
-                selected_urls.append(self.collected_urls[i])
-                selected_snippets.append(self.collected_snippets[i])
-
-        url_to_snippets = {}
-        for url, snippet in zip(selected_urls, selected_snippets):
-            if url not in url_to_snippets:
-                url_to_snippets[url] = set()
-            url_to_snippets[url].add(snippet)
+        return self.retrieve_information_batch([queries], search_top_k)[0]
+
+    def retrieve_information_batch(self, query_groups: List[List[str]], search_top_k) -> List[List[Dict[str, any]]]:
+        """
+        retrieve_information for several groups of queries (e.g. the outline of every section) at once:
+        the distinct queries of all groups are encoded in one call and scored in one pass over the table.
+        Returns one retrieve_information result per group.
+        """
+        distinct_queries = list(dict.fromkeys(query for queries in query_groups for query in queries))
+        query_rows = dict(zip(distinct_queries, self._rank_rows(distinct_queries, search_top_k)))
+        return [self._collect_information([query_rows[query] for query in queries]) for queries in query_groups]
+
+    def _rank_rows(self, queries: List[str], search_top_k) -> List[List[int]]:
+        """The table rows retrieved for each query, best first."""
+        if not queries or not len(self.table):
+            return [[] for _ in queries]
+        # All queries are encoded in one call and scored with one matrix multiply (see RetrievalTable.search).
+        query_vectors = self.table.encode_queries(queries)
+        rerank = self.mmr_lambda is not None or self.max_snippets_per_url is not None
+        # Re-ranking picks from a deeper candidate list.
+        depth = max(4 * search_top_k, 20) if rerank else search_top_k
+        if self.retrieval_fusion is not None:
+            indices, scores = self.table.hybrid_search(queries, query_vectors, depth, fusion=self.retrieval_fusion,
+                                                       dense_weight=self.fusion_dense_weight)
+        else:
+            indices, scores = self.table.search(query_vectors, depth)
+        if rerank:
+            # The fused scores keep the BM25 part of the ranking as the relevance term.
+            return self.table.mmr_rerank(query_vectors, indices, search_top_k,
+                                         1.0 if self.mmr_lambda is None else self.mmr_lambda,
+                                         self.max_snippets_per_url,
+                                         candidate_scores=scores if self.retrieval_fusion is not None else None)
+        return [list(row) for row in indices]
+
+    def _collect_information(self, rows_per_query: List[List[int]]) -> List[Dict[str, any]]:
+        url_to_snippet_ids = {}
+        for rows in rows_per_query:
+            for i in rows:
+                url = self.collected_urls[i]
+                if url not in url_to_snippet_ids:
+                    url_to_snippet_ids[url] = {}
+                url_to_snippet_ids[url][self.collected_snippet_ids[i]] = None
 
         result = []
-        for url, snippets in url_to_snippets.items():
+        for url, snippet_ids in url_to_snippet_ids.items():
             result.append({
                 'url': url,
-                'snippets': list(snippets)
+                'snippets': self.store.get_snippets(snippet_ids),
+                'snippet_ids': list(snippet_ids),
             })
 
         return result
@@ -0,0 +1,387 @@
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from src.tools.encoder import get_encoder, get_pooled_encoder
+from src.tools.lexical_index import BM25Index
+from src.tools.vector_index import INDEX_BACKENDS, CompactTable, exact_search, make_index
+from src.utils.EmbeddingCache import EmbeddingCache
+from src.utils.SnippetStore import SnippetStore
+
+
+class RetrievalTable():
+    """
+    Embedding table over the snippets of a SnippetStore, filled incrementally.
+
+    Pages are queued with add_page (the MindMap subscribes the table to its store, so this happens
+    while the map is being built) and encoded in background batches on a worker thread. urls,
+    snippet_ids and embeddings have corresponding rows; flush waits until every queued page is encoded.
+    """
+    def __init__(self, store: SnippetStore, encoder_path: Optional[str] = None, batch_size: int = 64, index_backend: str = 'exact',
+                 index_params: Optional[Dict] = None, ann_min_rows: int = 50000, ann_rerank: int = 4,
+                 embedding_cache: Optional[EmbeddingCache] = None, lexical_index: bool = False,
+                 storage: str = 'float32', pca_dim: Optional[int] = None, encode_processes: Optional[int] = None):
+        """
+        Args:
+            store: The snippet store holding the snippet texts.
+            encoder_path: Name or path of the SentenceTransformer model, taken from the shared encoder registry
+                on first use. None selects the configured default (see encoder.resolve_encoder_path).
+            batch_size: Maximum number of snippets encoded per background batch.
+            index_backend: 'exact', or an approximate nearest-neighbour backend from vector_index.INDEX_BACKENDS
+                ('hnsw' or 'ivfpq') for sub-linear search on large tables.
+            index_params: Keyword arguments of the backend, e.g. {'ef_search': 128} or {'nprobe': 32}, which
+                set its recall/latency trade-off.
+            ann_min_rows: Tables with fewer rows are always searched exactly.
+            ann_rerank: The approximate index returns ann_rerank * top_k candidates, which are rescored exactly.
+            embedding_cache: Optional persistent cache consulted before encoding any snippet.
+            lexical_index: Also keep a BM25 index over the same rows, which hybrid_search fuses with the
+                dense ranking.
+            storage: 'float32', or 'float16' / 'int8' to keep the normalized rows in a vector_index.CompactTable
+                and score them there (2x / ~4x less memory). Encoded batches are moved into it at the next search.
+            pca_dim: If set, rows are also reduced to this many principal components, fitted once the table
+                holds 4 * pca_dim rows (smaller tables keep full-dimension rows). get_storage_stats reports the
+                memory saved.
+            encode_processes: If set, snippets are encoded by a pool of this many worker processes
+                (see encoder.PooledEncoder), and each background batch takes every queued snippet instead
+                of batch_size. Queries are still encoded in process.
+        """
+        if storage not in CompactTable.DTYPES:
+            raise ValueError(f"storage must be one of {CompactTable.DTYPES}, got {storage!r}")
+        if index_backend != 'exact' and index_backend not in INDEX_BACKENDS:
+            raise ValueError(f"index_backend must be 'exact' or one of {tuple(INDEX_BACKENDS)}, got {index_backend!r}")
+        self.store = store
+        self.encoder_path = encoder_path
+        self.batch_size = batch_size
+        self.index_backend = index_backend
+        self.index_params = index_params
+        self.ann_min_rows = ann_min_rows
+        self.ann_rerank = ann_rerank
+        self.embedding_cache = embedding_cache
+        self.lexical = BM25Index() if lexical_index else None
+        self.storage = storage
+        self.compact = CompactTable(storage, pca_dim) if storage != 'float32' or pca_dim else None
+        self._input_dim = 0
+        self.encode_processes = encode_processes
+        self._index = None
+        self._index_components = None
+        self.urls = []
+        self.snippet_ids = []
+        self._encoder = None
+        self._chunks = []
+        self._embeddings = None
+        self._normalized = None
+        self._seen_urls = set()
+        self._pending = []
+        self._worker_running = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    @property
+    def encoder(self) -> SentenceTransformer:
+        with self._lock:
+            if self._encoder is None:
+                self._encoder = get_encoder(self.encoder_path)
+            return self._encoder
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def add_page(self, url: str, snippet_ids):
+        """Queue the snippets of a page for encoding. Pages already in the table are ignored."""
+        if not url:
+            return
+        with self._lock:
+            if url in self._seen_urls:
+                return
+            self._seen_urls.add(url)
+            self._pending.extend((url, snippet_id) for snippet_id in snippet_ids)
+            if not self._worker_running and self._pending:
+                self._start_worker()
+
+    def _start_worker(self):
+        # Called with self._lock held. A new worker first retries the batch a failed one put back.
+        self._error = None
+        self._worker_running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add_embeddings(self, urls: List[str], snippet_ids: List[str], embeddings: np.ndarray,
+                       texts: Optional[List[str]] = None):
+        """
+        Append rows that are already encoded, e.g. synthetic or precomputed embeddings. texts feed the
+        lexical index; without them the rows are only found by dense search.
+        """
+        tokens = [BM25Index.tokenize(text) for text in texts] if texts is not None else [[]] * len(urls)
+        with self._lock:
+            if self.lexical is not None:
+                self.lexical.add_tokens(tokens)
+            self.urls.extend(urls)
+            self.snippet_ids.extend(snippet_ids)
+            self._seen_urls.update(urls)
+            self._chunks.append(np.asarray(embeddings, dtype=np.float32))
+
+    def _run(self):
+        encoder = get_pooled_encoder(self.encoder_path, self.encode_processes) if self.encode_processes else self.encoder
+        batch_size = None if self.encode_processes else self.batch_size
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._worker_running = False
+                    self._idle.notify_all()
+                    return
+                batch = self._pending[:batch_size]
+                del self._pending[:batch_size]
+            try:
+                snippets = self.store.get_snippets(snippet_id for _, snippet_id in batch)
+                if self.embedding_cache is not None:
+                    vectors = self.embedding_cache.encode(encoder, snippets, show_progress_bar=False)
+                else:
+                    vectors = encoder.encode(snippets, show_progress_bar=False)
+                tokens = [BM25Index.tokenize(snippet) for snippet in snippets] if self.lexical is not None else None
+            except Exception as e:
+                with self._lock:
+                    # The batch goes back to the front of the queue, so no page is lost to a transient error.
+                    self._pending[:0] = batch
+                    self._error = e
+                    self._worker_running = False
+                    self._idle.notify_all()
+                return
+            with self._lock:
+                if tokens is not None:
+                    self.lexical.add_tokens(tokens)
+                self.urls.extend(url for url, _ in batch)
+                self.snippet_ids.extend(snippet_id for _, snippet_id in batch)
+                self._chunks.append(np.asarray(vectors, dtype=np.float32))
+
+    def flush(self):
+        """
+        Block until every queued page is encoded. If a background batch failed, the queue is encoded
+        again from that batch; the error is raised if it fails again, and every later flush retries
+        until the table is complete.
+        """
+        with self._idle:
+            while self._worker_running:
+                self._idle.wait()
+            if self._pending:
+                self._start_worker()
+                while self._worker_running:
+                    self._idle.wait()
+            if self._error is not None:
+                raise self._error
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        The (rows, dim) float32 matrix of the encoded snippets, assembled once per change. With compact
+        storage these are the dequantized (and PCA-reduced) unit rows, rebuilt on every call.
+        """
+        if self.compact is not None:
+            compact = self._compacted()
+            return compact[np.arange(len(compact))]
+        with self._lock:
+            if len(self._chunks) > 1:
+                self._chunks = [np.concatenate(self._chunks)]
+            if self._chunks and self._chunks[0] is not self._embeddings:
+                self._embeddings = self._chunks[0]
+                self._normalized = None
+            elif self._embeddings is None:
+                self._embeddings = np.zeros((0, 0), dtype=np.float32)
+            return self._embeddings
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    @property
+    def normalized_embeddings(self) -> np.ndarray:
+        """Unit-length rows of embeddings, computed once per change so that cosine similarity is a dot product."""
+        embeddings = self.embeddings
+        with self._lock:
+            if self._normalized is None or len(self._normalized) != len(embeddings):
+                self._normalized = self.normalize(embeddings)
+            return self._normalized
+
+    def _compacted(self) -> CompactTable:
+        """The compact table, after moving the batches encoded since the last call into it."""
+        with self._lock:
+            if self._chunks:
+                vectors = self.normalize(np.concatenate(self._chunks))
+                self._chunks = []
+                self._input_dim = vectors.shape[1]
+                self.compact.add(vectors)
+            return self.compact
+
+    def _search_table(self) -> Union[np.ndarray, CompactTable]:
+        return self._compacted() if self.compact is not None else self.normalized_embeddings
+
+    def _prepare_queries(self, query_vectors: np.ndarray) -> np.ndarray:
+        query_vectors = self.normalize(query_vectors)
+        if self.compact is not None:
+            query_vectors = self._compacted().transform(query_vectors)
+        return query_vectors
+
+    def get_storage_stats(self) -> Dict[str, object]:
+        """Bytes held by the searchable rows and the bytes saved against a float32 table of the encoder output."""
+        table = self._search_table()
+        rows, dim = table.shape if len(table) else (0, 0)
+        nbytes = table.nbytes
+        input_dim = self._input_dim if self.compact is not None else dim
+        float32_bytes = rows * input_dim * 4
+        return {
+            'storage': self.storage,
+            'pca_dim': self.compact.pca_dim if self.compact is not None else None,
+            'rows': rows,
+            'dim': dim,
+            'bytes': nbytes,
+            'float32_bytes': float32_bytes,
+            'saved_bytes': float32_bytes - nbytes,
+            'saved_ratio': 1 - nbytes / float32_bytes if float32_bytes else 0.0,
+        }
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return self.normalize(self.encoder.encode(queries, show_progress_bar=False))
+
+    def _ann_index(self):
+        """The approximate index, created on first use and brought up to date with the table."""
+        table = self._search_table()
+        with self._lock:
+            components = self.compact.components if self.compact is not None else None
+            if self._index is None or components is not self._index_components:
+                # Fitting PCA re-encodes every row, so the index is built again in the new space.
+                self._index = make_index(self.index_backend, table.shape[1], self.index_params)
+                self._index_components = components
+            if len(self._index) < len(table):
+                self._index.add(table[len(self._index):])
+            return self._index
+
+    def search(self, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine top-k for a batch of queries. Uses the approximate index_backend once the table has
+        ann_min_rows rows, and the exact scan (see vector_index.exact_search) below that.
+
+        Returns:
+            (indices, scores), both (len(query_vectors), min(top_k, len(self))), best match first.
+        """
+        return self._search(self._prepare_queries(query_vectors), top_k)
+
+    def _search(self, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        table = self._search_table()
+        if self.index_backend == 'exact' or len(table) < self.ann_min_rows:
+            return exact_search(table, query_vectors, top_k)
+
+        # Take ann_rerank times more candidates from the index and rescore them exactly, which recovers
+        # most of the recall lost to quantization at a cost independent of the table size.
+        candidates, _ = self._ann_index().search(query_vectors, top_k * self.ann_rerank)
+        valid = candidates >= 0
+        candidates = np.where(valid, candidates, 0)
+        scores = np.einsum('qd,qkd->qk', query_vectors, table[candidates])
+        scores = np.where(valid, scores, -np.inf)
+        k = min(top_k, len(table))
+        order = np.argsort(-scores, axis=1)[:, :k]
+        indices = np.take_along_axis(candidates, order, axis=1).astype(np.int64)
+        scores = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+        # The index pads with -1 when it finds fewer than k rows; those queries are searched exactly.
+        short = valid.sum(axis=1) < k
+        if short.any():
+            indices[short], scores[short] = exact_search(table, query_vectors[short], top_k)
+        return indices, scores
+
+    def hybrid_search(self, queries: List[str], query_vectors: np.ndarray, top_k: int, fusion: str = 'rrf',
+                      dense_weight: float = 0.5, depth: Optional[int] = None,
+                      rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k by fusing the dense ranking of search with the BM25 ranking of the lexical index.
+
+        Args:
+            queries, query_vectors: The query texts and their embeddings, in the same order.
+            fusion: 'rrf' sums 1 / (rrf_k + rank) over both rankings; 'weighted' mixes the cosine similarity
+                with the BM25 score scaled to [0, 1] by the best score of the query, weighting the dense part
+                by dense_weight.
+            depth: Number of candidates taken from each ranking, by default max(4 * top_k, 50).
+
+        Returns:
+            (indices, scores) like search, with the fused scores.
+        """
+        if self.lexical is None:
+            raise ValueError('hybrid_search needs a table created with lexical_index=True')
+        if fusion not in ('rrf', 'weighted'):
+            raise ValueError(f"fusion must be 'rrf' or 'weighted', got {fusion!r}")
+        query_vectors = self._prepare_queries(query_vectors)
+        depth = depth or max(4 * top_k, 50)
+        dense_indices, _ = self._search(query_vectors, depth)
+        table = self._search_table()
+        k = min(top_k, len(table))
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.zeros((len(queries), k), dtype=np.float32)
+        for q, query in enumerate(queries):
+            # Rows added by the worker after the dense snapshot are left for the next call.
+            lexical_scores = self.lexical.scores(query)[:len(table)]
+            lexical_indices = BM25Index.top(lexical_scores, depth)
+            if fusion == 'rrf':
+                fused = {}
+                for ranking in (dense_indices[q], lexical_indices):
+                    for rank, row in enumerate(ranking):
+                        fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+                candidates = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+                candidate_scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+            else:
+                candidates = np.union1d(dense_indices[q], lexical_indices).astype(np.int64)
+                best = lexical_scores[lexical_indices[0]] if len(lexical_indices) else 1.0
+                candidate_scores = (dense_weight * (table[candidates] @ query_vectors[q])
+                                    + (1 - dense_weight) * lexical_scores[candidates] / best)
+            order = np.argsort(-candidate_scores, kind='stable')[:k]
+            indices[q] = candidates[order]
+            scores[q] = candidate_scores[order]
+        return indices, scores
+
+    def mmr_rerank(self, query_vectors: np.ndarray, candidates: np.ndarray, top_k: int, mmr_lambda: float = 0.5,
+                   max_per_url: Optional[int] = None,
+                   candidate_scores: Optional[np.ndarray] = None) -> List[List[int]]:
+        """
+        Maximal marginal relevance selection of top_k rows from each query's candidates (e.g. the indices
+        returned by search with a larger top_k), using the embeddings already in the table.
+
+        Each step picks the candidate maximizing mmr_lambda * sim(query, row) - (1 - mmr_lambda) * the
+        highest similarity to a row already picked, so near-duplicates (such as the same text on mirrored
+        pages) are passed over. At most max_per_url rows of one URL are picked per query.
+
+        candidate_scores, e.g. the fused scores of hybrid_search, replace sim(query, row) as the relevance
+        term. They are min-max scaled to [0, 1] per query to be comparable with the cosine redundancy.
+
+        Returns:
+            For each query, up to top_k row indices in the order they were picked.
+        """
+        query_vectors = self._prepare_queries(query_vectors)
+        table = self._search_table()
+        results = []
+        for q, (query_vector, row_candidates) in enumerate(zip(query_vectors, candidates)):
+            row_candidates = np.asarray(row_candidates, dtype=np.int64)
+            vectors = table[row_candidates]
+            if candidate_scores is None:
+                relevance = vectors @ query_vector
+            else:
+                relevance = np.asarray(candidate_scores[q], dtype=np.float32)
+                low = relevance.min() if len(relevance) else 0.0
+                high = relevance.max() if len(relevance) else 0.0
+                relevance = (relevance - low) / (high - low) if high > low else np.ones_like(relevance)
+            similarity = vectors @ vectors.T
+            redundancy = np.full(len(row_candidates), -np.inf, dtype=np.float32)
+            available = np.ones(len(row_candidates), dtype=bool)
+            url_counts = {}
+            picked = []
+            while len(picked) < top_k and available.any():
+                scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy if picked else relevance
+                best = int(np.argmax(np.where(available, scores, -np.inf)))
+                available[best] = False
+                url = self.urls[row_candidates[best]]
+                if max_per_url is not None and url_counts.get(url, 0) >= max_per_url:
+                    continue
+                url_counts[url] = url_counts.get(url, 0) + 1
+                picked.append(int(row_candidates[best]))
+                redundancy = np.maximum(redundancy, similarity[best])
+            results.append(picked)
+        return results
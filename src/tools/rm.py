@@ -1,6 +1,8 @@
+import concurrent.futures
 import logging
 import os
-from typing import Callable, Union, List
+import threading
+from typing import Callable, Iterator, Union, List, Dict
 import dspy
 import requests
 import re
@@ -70,8 +72,8 @@ class GoogleSearchAli(dspy.Retrieve):
 
         return {'BingSearch': usage}
 
-    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
-
+    def _search_results(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Dict[str, Dict]:
+        """Search results of the query or queries by URL, each a dict with 'url', 'title' and 'description'."""
         queries = (
             [query_or_queries]
             if isinstance(query_or_queries, str)
@@ -83,11 +85,12 @@ class GoogleSearchAli(dspy.Retrieve):
 
         for query in queries:
             try:
-                self.template["uq"] = query
+                # A payload per query, as SearchResultCache searches from several threads at once.
+                payload = dict(self.template, uq=query)
 
                 response = requests.post(
                     "https://nlp-cn-beijing.aliyuncs.com/gw/v1/api/msearch-sp/qwen-search",
-                    data=json.dumps(self.template),
+                    data=json.dumps(payload),
                     headers=self.header,
                 )              
                 response = json.loads(response.text)
@@ -100,7 +103,10 @@ class GoogleSearchAli(dspy.Retrieve):
                     }
             except Exception as e:
                 logging.error(f'Error occurs when searching query {query}: {e}')
+        return url_to_results
 
+    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
         valid_url_to_snippets = self.webpage_helper.urls_to_snippets(list(url_to_results.keys()))
         collected_results = []
         for url in valid_url_to_snippets:
@@ -110,6 +116,17 @@ class GoogleSearchAli(dspy.Retrieve):
 
         print(f'lengt of collected_results :{len(collected_results)}')
         return collected_results
+
+    def iter_forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Iterator[Dict]:
+        """
+        forward as a generator: yields each result (same keys as in forward) as soon as its page has been
+        downloaded and split, in completion order, so consumers can start on the first pages.
+        """
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
+        for url, snippets in self.webpage_helper.iter_urls_to_snippets(list(url_to_results.keys())):
+            r = url_to_results[url]
+            r['snippets'] = snippets
+            yield r
     
 
 class BingSearchAli(dspy.Retrieve):
@@ -159,16 +176,8 @@ class BingSearchAli(dspy.Retrieve):
 
         return {'BingSearch': usage}
 
-    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
-        """Search with Bing for self.k top passages for query or queries
-
-        Args:
-            query_or_queries (Union[str, List[str]]): The query or queries to search for.
-            exclude_urls (List[str]): A list of urls to exclude from the search results.
-
-        Returns:
-            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
-        """
+    def _search_results(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Dict[str, Dict]:
+        """Search results of the query or queries by URL, each a dict with 'url', 'title' and 'description'."""
         queries = (
             [query_or_queries]
             if isinstance(query_or_queries, str)
@@ -212,7 +221,19 @@ class BingSearchAli(dspy.Retrieve):
                     }
             except Exception as e:
                 logging.error(f'Error occurs when searching query {query}: {e}')
+        return url_to_results
+
+    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
+        """Search with Bing for self.k top passages for query or queries
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
 
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
         valid_url_to_snippets = self.webpage_helper.urls_to_snippets(list(url_to_results.keys()))
         collected_results = []
         for url in valid_url_to_snippets:
@@ -221,6 +242,17 @@ class BingSearchAli(dspy.Retrieve):
             collected_results.append(r)
         return collected_results
 
+    def iter_forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Iterator[Dict]:
+        """
+        forward as a generator: yields each result (same keys as in forward) as soon as its page has been
+        downloaded and split, in completion order, so consumers can start on the first pages.
+        """
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
+        for url, snippets in self.webpage_helper.iter_urls_to_snippets(list(url_to_results.keys())):
+            r = url_to_results[url]
+            r['snippets'] = snippets
+            yield r
+
 
 class BingSearch(dspy.Retrieve):
     def __init__(self, bing_search_api_key=None, k=3, is_valid_source: Callable = None,
@@ -268,16 +300,8 @@ class BingSearch(dspy.Retrieve):
 
         return {'BingSearch': usage}
 
-    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
-        """Search with Bing for self.k top passages for query or queries
-
-        Args:
-            query_or_queries (Union[str, List[str]]): The query or queries to search for.
-            exclude_urls (List[str]): A list of urls to exclude from the search results.
-
-        Returns:
-            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
-        """
+    def _search_results(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Dict[str, Dict]:
+        """Search results of the query or queries by URL, each a dict with 'url', 'title' and 'description'."""
         queries = (
             [query_or_queries]
             if isinstance(query_or_queries, str)
@@ -302,7 +326,19 @@ class BingSearch(dspy.Retrieve):
                         url_to_results[d['url']] = {'url': d['url'], 'title': d['name'], 'description': d['snippet']}
             except Exception as e:
                 logging.error(f'Error occurs when searching query {query}: {e}')
+        return url_to_results
+
+    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
+        """Search with Bing for self.k top passages for query or queries
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
 
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
         valid_url_to_snippets = self.webpage_helper.urls_to_snippets(list(url_to_results.keys()))
         collected_results = []
         for url in valid_url_to_snippets:
@@ -311,3 +347,189 @@ class BingSearch(dspy.Retrieve):
             collected_results.append(r)
         return collected_results
 
+    def iter_forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []) -> Iterator[Dict]:
+        """
+        forward as a generator: yields each result (same keys as in forward) as soon as its page has been
+        downloaded and split, in completion order, so consumers can start on the first pages.
+        """
+        url_to_results = self._search_results(query_or_queries, exclude_urls)
+        for url, snippets in self.webpage_helper.iter_urls_to_snippets(list(url_to_results.keys())):
+            r = url_to_results[url]
+            r['snippets'] = snippets
+            yield r
+
+
+class SearchResultCache:
+    """Map-wide cache that sits between MindPoint and a dspy.Retrieve retriever.
+
+    Results are cached per normalized query, so sibling nodes asking for the same (or trivially
+    different) keywords share one search. Concurrent requests for a query that is already being
+    searched wait for that search instead of issuing their own.
+
+    For the retrievers in this module, which search and then download every result page, only the
+    search results are cached per query. The pages of all the queries of one call are then
+    downloaded and split together, once per URL, and their snippets are cached per URL, so a page
+    returned for several keywords is fetched once. Other retrievers are cached per query as a whole.
+    """
+
+    def __init__(self, retriever, max_thread_num: int = 5):
+        """
+        Args:
+            retriever: The wrapped retriever, called with a list of queries.
+            max_thread_num: Maximum number of uncached queries searched concurrently in one call.
+        """
+        self.retriever = retriever
+        self.max_thread_num = max_thread_num
+        self._split_pages = hasattr(retriever, '_search_results') and hasattr(retriever, 'webpage_helper')
+        self._results = {}
+        self._inflight = {}
+        # url -> snippets, None for a page that did not yield an article.
+        self._snippets = {}
+        self._inflight_pages = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+        self.page_hits = 0
+        self.page_downloads = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return ' '.join(re.findall(r'\w+', query.lower()))
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses + self.merged
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'merged': self.merged,
+                'hit_rate': (self.hits + self.merged) / total if total else 0.0,
+                'page_hits': self.page_hits,
+                'page_downloads': self.page_downloads,
+            }
+
+    def get_usage_and_reset(self):
+        return self.retriever.get_usage_and_reset()
+
+    def _search(self, key: str, query: str, future: concurrent.futures.Future):
+        try:
+            if self._split_pages:
+                results = list(self.retriever._search_results([query]).values())
+            else:
+                results = self.retriever([query])
+        except Exception as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            return
+        with self._lock:
+            # Empty results are usually a failed search, so they are not kept for later callers.
+            if results:
+                self._results[key] = results
+            del self._inflight[key]
+        future.set_result(results)
+
+    def _add_snippets(self, url_to_results: Dict[str, Dict]) -> List[Dict]:
+        """
+        Attach the snippets of every page, downloading the pages not cached yet in one batch. Pages that
+        a concurrent call is already downloading are waited for instead of being downloaded again.
+        """
+        to_download = {}
+        waiting = {}
+        with self._lock:
+            for url in url_to_results:
+                if url in self._snippets:
+                    self.page_hits += 1
+                elif url in self._inflight_pages:
+                    self.page_hits += 1
+                    waiting[url] = self._inflight_pages[url]
+                else:
+                    future = concurrent.futures.Future()
+                    self._inflight_pages[url] = future
+                    waiting[url] = to_download[url] = future
+            self.page_downloads += len(to_download)
+        if to_download:
+            try:
+                articles = self.retriever.webpage_helper.urls_to_snippets(list(to_download))
+            except Exception as e:
+                articles = None
+                error = e
+            with self._lock:
+                for url in to_download:
+                    del self._inflight_pages[url]
+                    if articles is not None:
+                        self._snippets[url] = articles[url]['snippets'] if url in articles else None
+            for url, future in to_download.items():
+                if articles is None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(self._snippets[url])
+
+        collected_results = []
+        for url, r in url_to_results.items():
+            if url in waiting:
+                try:
+                    snippets = waiting[url].result()
+                except Exception as e:
+                    logging.error(f'Error occurs when downloading {url}: {e}')
+                    snippets = None
+            else:
+                with self._lock:
+                    snippets = self._snippets[url]
+            if snippets is not None:
+                r['snippets'] = snippets
+                collected_results.append(r)
+        return collected_results
+
+    def __call__(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []):
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+
+        per_query_results = {}
+        waiting = {}
+        to_search = {}
+        with self._lock:
+            for query in queries:
+                key = self.normalize_query(query)
+                if key in per_query_results or key in waiting or key in to_search:
+                    continue
+                if key in self._results:
+                    self.hits += 1
+                    per_query_results[key] = self._results[key]
+                elif key in self._inflight:
+                    self.merged += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    future = concurrent.futures.Future()
+                    self._inflight[key] = future
+                    waiting[key] = future
+                    to_search[key] = (query, future)
+
+        if len(to_search) == 1:
+            key, (query, future) = next(iter(to_search.items()))
+            self._search(key, query, future)
+        elif to_search:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num) as executor:
+                for key, (query, future) in to_search.items():
+                    executor.submit(self._search, key, query, future)
+
+        for key, future in waiting.items():
+            try:
+                per_query_results[key] = future.result()
+            except Exception as e:
+                logging.error(f'Error occurs when searching query {key}: {e}')
+                per_query_results[key] = []
+
+        url_to_results = {}
+        for query in queries:
+            for r in per_query_results[self.normalize_query(query)]:
+                if r['url'] not in url_to_results and r['url'] not in exclude_urls:
+                    url_to_results[r['url']] = dict(r)
+        if self._split_pages:
+            return self._add_snippets(url_to_results)
+        return list(url_to_results.values())
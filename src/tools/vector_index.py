@@ -0,0 +1,216 @@
+import math
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+
+class CompactTable():
+    """
+    Unit-length embedding rows stored at reduced precision: 'float16', or 'int8' with one float32 scale
+    per row ('float32' keeps full precision, for PCA alone). With pca_dim, rows are first projected onto their top pca_dim principal components (fitted
+    once pca_min_rows rows have been added, on all of them; until then rows keep their full dimension)
+    and renormalized; queries must go through transform to be scored in the same space.
+
+    Scores are computed block_rows rows at a time, so no float32 copy of the whole table is ever made.
+    Indexing with an array of row numbers returns the dequantized float32 rows.
+    """
+    DTYPES = ('float32', 'float16', 'int8')
+
+    def __init__(self, dtype: str = 'float16', pca_dim: Optional[int] = None, block_rows: int = 16384,
+                 pca_min_rows: Optional[int] = None):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"dtype must be one of {self.DTYPES}, got {dtype!r}")
+        self.dtype = dtype
+        self.pca_dim = pca_dim
+        self.pca_min_rows = pca_min_rows if pca_min_rows is not None else 4 * (pca_dim or 0)
+        self.block_rows = block_rows
+        self.mean = None
+        self.components = None
+        self._codes = []
+        self._scales = []
+
+    def _fit_pca(self, vectors: np.ndarray):
+        self.mean = vectors.mean(axis=0)
+        centered = vectors - self.mean
+        # Eigenvectors of the (dim, dim) covariance, largest eigenvalues first, are the principal axes.
+        _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        dim = min(self.pca_dim, len(vectors), vectors.shape[1])
+        self.components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :dim], dtype=np.float32)
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Project unit-length vectors into the stored space (a no-op without PCA) and renormalize them."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is None:
+            return vectors
+        projected = (vectors - self.mean) @ self.components
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.where(norms == 0, 1.0, norms)
+
+    def add(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        self._append(self.transform(vectors))
+        if self.pca_dim is not None and self.components is None and len(self) >= self.pca_min_rows:
+            # Fit on every row so far and store them again in the reduced space.
+            rows = self[np.arange(len(self))]
+            self._codes, self._scales = [], []
+            self._fit_pca(rows)
+            self._append(self.transform(rows))
+
+    def _append(self, vectors: np.ndarray):
+        if self.dtype != 'int8':
+            self._codes.append(vectors.astype(self.dtype))
+        else:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+            self._codes.append(np.round(vectors / scales[:, None]).astype(np.int8))
+            self._scales.append(scales)
+        if len(self._codes) > 1:
+            self._codes = [np.concatenate(self._codes)]
+            if self._scales:
+                self._scales = [np.concatenate(self._scales)]
+
+    def __len__(self) -> int:
+        return len(self._codes[0]) if self._codes else 0
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        if self._codes:
+            return self._codes[0].shape
+        return 0, (self.components.shape[1] if self.components is not None else 0)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self._codes + self._scales)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        vectors = self._codes[0][rows].astype(np.float32)
+        if self.dtype == 'int8':
+            vectors *= self._scales[0][rows][..., None]
+        return vectors
+
+    def scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """(len(query_vectors), len(self)) inner products of transformed query_vectors with every row."""
+        scores = np.empty((len(query_vectors), len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = self._codes[0][start:start + self.block_rows].astype(np.float32, copy=False)
+            block_scores = query_vectors @ block.T
+            if self.dtype == 'int8':
+                block_scores *= self._scales[0][start:start + self.block_rows]
+            scores[:, start:start + self.block_rows] = block_scores
+        return scores
+
+
+def exact_search(table: Union[np.ndarray, CompactTable], query_vectors: np.ndarray, top_k: int,
+                 query_batch_size: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact inner-product top-k of unit-length query_vectors against the unit-length rows of table:
+    one matrix multiply per query_batch_size queries and argpartition instead of a full sort. A
+    CompactTable is scored on its compact rows (query_vectors must already be transformed).
+
+    Returns:
+        (indices, scores), both (len(query_vectors), min(top_k, len(table))), best match first.
+    """
+    k = min(top_k, len(table))
+    all_indices = []
+    all_scores = []
+    for start in range(0, len(query_vectors), query_batch_size):
+        batch = query_vectors[start:start + query_batch_size]
+        scores = table.scores(batch) if isinstance(table, CompactTable) else batch @ table.T
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)[:, :k]
+        all_indices.append(np.take_along_axis(candidates, order, axis=1))
+        all_scores.append(np.take_along_axis(candidate_scores, order, axis=1))
+    if not all_indices:
+        return np.zeros((0, k), dtype=np.int64), np.zeros((0, k), dtype=np.float32)
+    return np.concatenate(all_indices), np.concatenate(all_scores)
+
+
+class HNSWIndex():
+    """
+    Approximate inner-product index on an HNSW graph (requires hnswlib). Rows can be added at any time.
+
+    Recall/latency is set by ef_search (higher is more accurate and slower); M and ef_construction
+    trade build time and memory for graph quality.
+    """
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("index_backend='hnsw' requires hnswlib: pip install hnswlib")
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space='ip', dim=dim)
+        self.index.init_index(max_elements=1024, M=M, ef_construction=ef_construction)
+
+    def __len__(self) -> int:
+        return self.index.get_current_count()
+
+    def add(self, vectors: np.ndarray):
+        start = len(self)
+        if start + len(vectors) > self.index.get_max_elements():
+            self.index.resize_index(max(2 * self.index.get_max_elements(), start + len(vectors)))
+        self.index.add_items(vectors, np.arange(start, start + len(vectors)))
+
+    def search(self, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(top_k, len(self))
+        self.index.set_ef(max(self.ef_search, k))
+        labels, distances = self.index.knn_query(query_vectors, k=k)
+        # hnswlib's 'ip' distance is 1 - inner product.
+        return labels.astype(np.int64), 1.0 - distances
+
+
+class IVFPQIndex():
+    """
+    Approximate inner-product index with an inverted file and product-quantized codes (requires faiss).
+    It is trained on the rows present at the first add; later rows are encoded with that training.
+
+    Recall/latency is set by nprobe (inverted lists scanned per query). nlist defaults to 4 * sqrt(rows);
+    m subquantizers of nbits bits set the code size (m must divide the dimension).
+    """
+    def __init__(self, dim: int, nlist: Optional[int] = None, m: int = 16, nbits: int = 8, nprobe: int = 16):
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("index_backend='ivfpq' requires faiss: pip install faiss-cpu")
+        self.faiss = faiss
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.index = None
+
+    def __len__(self) -> int:
+        return 0 if self.index is None else self.index.ntotal
+
+    def add(self, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is None:
+            nlist = self.nlist or max(1, int(4 * math.sqrt(len(vectors))))
+            quantizer = self.faiss.IndexFlatIP(self.dim)
+            self.index = self.faiss.IndexIVFPQ(quantizer, self.dim, nlist, self.m, self.nbits,
+                                               self.faiss.METRIC_INNER_PRODUCT)
+            self.index.train(vectors)
+        self.index.add(vectors)
+
+    def search(self, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.index.nprobe = self.nprobe
+        scores, labels = self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), min(top_k, len(self)))
+        return labels.astype(np.int64), scores
+
+
+INDEX_BACKENDS = {
+    'hnsw': HNSWIndex,
+    'ivfpq': IVFPQIndex,
+}
+
+
+def make_index(backend: str, dim: int, params: Optional[Dict] = None):
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"index_backend must be 'exact' or one of {tuple(INDEX_BACKENDS)}, got {backend!r}")
+    return INDEX_BACKENDS[backend](dim, **(params or {}))
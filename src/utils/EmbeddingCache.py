@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+KEY_BYTES = 12
+
+
+class EmbeddingCache:
+    """Persistent, size-bounded cache of text embeddings keyed by (encoder model, text hash).
+
+    Each model gets its own directory under cache_dir holding three memory-mapped arrays of max_entries
+    rows: the float32 vectors, the 12-byte blake2b hash of each row's text and a last-use stamp per row.
+    The hash index is rebuilt in memory from the key array when the cache is opened. When the cache is
+    full, the least recently used rows are overwritten. One process should write to a cache at a time.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int = 1_000_000):
+        """
+        Args:
+            cache_dir: Root directory of the cache.
+            model_name: Name or path of the encoder model; vectors of different models never mix.
+            max_entries: Maximum number of cached vectors.
+        """
+        self.model_name = model_name
+        self.directory = os.path.join(cache_dir, hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:16])
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._keys = None
+        self._stamps = None
+        self._rows = {}
+        self._size = 0
+        self._clock = 0
+        if os.path.exists(self._path('meta.json')):
+            self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self, dim: Optional[int] = None):
+        if dim is None:
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            dim, self.max_entries, self._size = meta['dim'], meta['max_entries'], meta['size']
+            mode = 'r+'
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            mode = 'w+'
+        self._vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode=mode, shape=(self.max_entries, dim))
+        self._keys = np.memmap(self._path('keys.u8'), dtype=np.uint8, mode=mode, shape=(self.max_entries, KEY_BYTES))
+        self._stamps = np.memmap(self._path('stamps.i64'), dtype=np.int64, mode=mode, shape=(self.max_entries,))
+        self._rows = {self._keys[row].tobytes(): row for row in range(self._size)}
+        self._clock = int(self._stamps[:self._size].max()) if self._size else 0
+        if mode == 'w+':
+            self._write_meta()
+
+    def _write_meta(self):
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model_name, 'dim': self._vectors.shape[1], 'max_entries': self.max_entries,
+                       'size': self._size}, f)
+
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_BYTES).digest()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """The cached vector of each key, or None where it is not cached."""
+        with self._lock:
+            self._clock += 1
+            found = []
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    found.append(None)
+                    continue
+                self._stamps[row] = self._clock
+                found.append(np.array(self._vectors[row]))
+            hits = sum(vector is not None for vector in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+
+    def put(self, keys: Sequence[bytes], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._open(dim=vectors.shape[1])
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            new = list(dict(new).items())[-self.max_entries:]
+            if not new:
+                return
+            self._clock += 1
+            free_rows = list(range(self._size, min(self._size + len(new), self.max_entries)))
+            if len(free_rows) < len(new):
+                # Full: overwrite the least recently used rows.
+                n_evict = len(new) - len(free_rows)
+                evicted = np.argpartition(self._stamps[:self._size], n_evict - 1)[:n_evict]
+                for row in evicted:
+                    del self._rows[self._keys[row].tobytes()]
+                free_rows.extend(int(row) for row in evicted)
+            self._size = min(self._size + len(new), self.max_entries)
+            for row, (key, vector) in zip(free_rows, new):
+                self._vectors[row] = vector
+                self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+                self._stamps[row] = self._clock
+                self._rows[key] = row
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._keys.flush()
+            self._stamps.flush()
+            self._write_meta()
+
+    def encode(self, encoder, texts: List[str], **encode_kwargs) -> np.ndarray:
+        """encoder.encode(texts) that only encodes the texts missing from the cache, then stores them."""
+        keys = [self.text_key(text) for text in texts]
+        found = self.get(keys)
+        missing = [i for i, vector in enumerate(found) if vector is None]
+        if missing:
+            vectors = np.asarray(encoder.encode([texts[i] for i in missing], **encode_kwargs), dtype=np.float32)
+            self.put([keys[i] for i in missing], vectors)
+            self.flush()
+            for i, vector in zip(missing, vectors):
+                found[i] = vector
+        if not found:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(found)
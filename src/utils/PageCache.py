@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class PageCache:
+    """Disk-backed cache of downloaded pages and their extracted text, keyed by URL (one sqlite file).
+
+    A page younger than ttl seconds is served without a request. An older one is revalidated with
+    If-None-Match / If-Modified-Since, and a 304 answer refreshes it without downloading the body again.
+    Its extracted text stays valid until the body changes. When the stored bodies and texts exceed max_bytes,
+    the least recently used pages are evicted. Failed downloads (error status, page rejected by the
+    DownloadGuard) are recorded too, so the URL is not requested again for negative_ttl seconds.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 2 * 1024 ** 3,
+                 negative_ttl: float = 24 * 3600):
+        """
+        Args:
+            path: The sqlite file; its directory is created if needed.
+            ttl: Seconds a page is served without revalidation.
+            max_bytes: Size cap of the stored bodies and texts.
+            negative_ttl: Seconds a failed download is remembered.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, body BLOB, text TEXT, etag TEXT, last_modified TEXT,
+            fetched_at REAL, accessed_at REAL, size INTEGER)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS failures (url TEXT PRIMARY KEY, reason TEXT, failed_at REAL)')
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.text_hits = 0
+        self.negative_hits = 0
+
+    def _row(self, url: str):
+        return self._db.execute('SELECT body, etag, last_modified, fetched_at FROM pages WHERE url = ?',
+                                (url,)).fetchone()
+
+    def lookup(self, url: str) -> Tuple[bool, Optional[bytes]]:
+        """
+        (True, body) if url has a body younger than ttl, (True, None) if its download failed less than
+        negative_ttl ago, else (False, None) and the caller should request it.
+        """
+        with self._lock:
+            now = time.time()
+            row = self._row(url)
+            if row is not None and now - row[3] <= self.ttl:
+                self._db.execute('UPDATE pages SET accessed_at = ? WHERE url = ?', (now, url))
+                self.hits += 1
+                return True, row[0]
+            failure = self._db.execute('SELECT failed_at FROM failures WHERE url = ?', (url,)).fetchone()
+            if failure is not None and now - failure[0] <= self.negative_ttl:
+                self.negative_hits += 1
+                return True, None
+            return False, None
+
+    def fresh_body(self, url: str) -> Optional[bytes]:
+        """The body returned by lookup: None both for a recorded failure and for a page to request."""
+        return self.lookup(url)[1]
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Revalidation headers for a stale cached page; empty if url is not cached."""
+        with self._lock:
+            row = self._row(url)
+        headers = {}
+        if row is not None:
+            if row[1]:
+                headers['If-None-Match'] = row[1]
+            if row[2]:
+                headers['If-Modified-Since'] = row[2]
+        return headers
+
+    def update(self, url: str, status_code: int, body: bytes, headers) -> Optional[bytes]:
+        """
+        Record a response to a (possibly conditional) request for url and return the page body: the
+        cached one for a 304, else the new body, which replaces the cached page and its text.
+        """
+        now = time.time()
+        with self._lock:
+            if status_code == 304:
+                row = self._row(url)
+                if row is None:
+                    return None
+                self._db.execute('UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+                self.revalidated += 1
+                return row[0]
+            self.misses += 1
+            old = self._db.execute('SELECT size FROM pages WHERE url = ?', (url,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, NULL, ?, ?, ?, ?, ?)',
+                             (url, body, headers.get('etag'), headers.get('last-modified'), now, now, len(body)))
+            self._db.execute('DELETE FROM failures WHERE url = ?', (url,))
+            self._total += len(body) - (old[0] if old else 0)
+            self._evict()
+            return body
+
+    def put_failure(self, url: str, reason: str):
+        """Record that downloading url failed (e.g. 'status 404'); any cached page of url is dropped."""
+        now = time.time()
+        with self._lock:
+            old = self._db.execute('SELECT size FROM pages WHERE url = ?', (url,)).fetchone()
+            if old is not None:
+                self._db.execute('DELETE FROM pages WHERE url = ?', (url,))
+                self._total -= old[0]
+            self._db.execute('DELETE FROM failures WHERE failed_at < ?', (now - self.negative_ttl,))
+            self._db.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?)', (url, reason, now))
+
+    def get_text(self, url: str) -> Optional[str]:
+        """The text extracted from the cached body of url, '' if extraction found none, None if not extracted."""
+        with self._lock:
+            row = self._db.execute('SELECT text FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            self.text_hits += 1
+            return row[0]
+
+    def put_text(self, url: str, text: Optional[str]):
+        text = text or ''
+        with self._lock:
+            row = self._db.execute('SELECT text FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None or row[0] is not None:
+                return
+            size = len(text.encode('utf-8'))
+            self._db.execute('UPDATE pages SET text = ?, size = size + ? WHERE url = ?', (text, size, url))
+            self._total += size
+            self._evict()
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        excess = self._total - self.max_bytes
+        freed = 0
+        urls = []
+        for url, size in self._db.execute('SELECT url, size FROM pages ORDER BY accessed_at'):
+            if freed >= excess:
+                break
+            urls.append((url,))
+            freed += size
+        self._db.executemany('DELETE FROM pages WHERE url = ?', urls)
+        self._total -= freed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'text_hits': self.text_hits,
+            'negative_hits': self.negative_hits,
+            'bytes': self._total,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import httpx
+import numpy as np
+
+from src.utils.PageCache import PageCache
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'application/xml', 'text/xml', 'text/plain')
+
+
+class DownloadGuard:
+    """Streaming read of response bodies that gives up early on pages that cannot become articles.
+
+    A response is dropped before its body is read when its Content-Type is not one of content_types or its
+    Content-Length exceeds max_bytes, and while streaming once more than max_bytes have arrived. The
+    bytes that were not downloaded (when the server declared a length) and the time they would have
+    taken at the observed download rate are counted in get_stats.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = 2 * 1024 ** 2,
+                 content_types: Optional[Sequence[str]] = HTML_CONTENT_TYPES):
+        """
+        Args:
+            max_bytes: Largest body kept, None for no limit.
+            content_types: Accepted media types, None to accept any. Responses without a Content-Type are kept.
+        """
+        self.max_bytes = max_bytes
+        self.content_types = tuple(content_types) if content_types is not None else None
+        self._lock = threading.Lock()
+        self.skipped_content_type = 0
+        self.skipped_too_large = 0
+        self.saved_bytes = 0
+        self.read_bytes = 0
+        self.read_seconds = 0.0
+
+    def _declared_length(self, response: httpx.Response) -> Optional[int]:
+        try:
+            return int(response.headers['content-length'])
+        except (KeyError, ValueError):
+            return None
+
+    def _skip(self, reason: str, declared: Optional[int], read: int):
+        with self._lock:
+            if reason == 'content_type':
+                self.skipped_content_type += 1
+            else:
+                self.skipped_too_large += 1
+            if declared is not None and declared > read:
+                self.saved_bytes += declared - read
+
+    def accepts(self, response: httpx.Response) -> bool:
+        """Whether the body of response is worth reading, judged from its headers."""
+        media_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        declared = self._declared_length(response)
+        if self.content_types is not None and media_type and media_type not in self.content_types:
+            self._skip('content_type', declared, 0)
+            return False
+        if self.max_bytes is not None and declared is not None and declared > self.max_bytes:
+            self._skip('too_large', declared, 0)
+            return False
+        return True
+
+    def _add(self, chunks: List[bytes], chunk: bytes, total: int) -> bool:
+        chunks.append(chunk)
+        return self.max_bytes is None or total <= self.max_bytes
+
+    def _finish(self, response: httpx.Response, chunks: List[bytes], total: int, complete: bool,
+                seconds: float) -> Optional[bytes]:
+        with self._lock:
+            self.read_bytes += total
+            self.read_seconds += seconds
+        if not complete:
+            self._skip('too_large', self._declared_length(response), total)
+            return None
+        return b''.join(chunks)
+
+    def read(self, response: httpx.Response) -> Optional[bytes]:
+        """The body of a streamed response, or None if it is rejected (see accepts) or exceeds max_bytes."""
+        if not self.accepts(response):
+            return None
+        start = time.perf_counter()
+        chunks, total, complete = [], 0, True
+        for chunk in response.iter_bytes():
+            total += len(chunk)
+            if not self._add(chunks, chunk, total):
+                complete = False
+                break
+        return self._finish(response, chunks, total, complete, time.perf_counter() - start)
+
+    async def aread(self, response: httpx.Response) -> Optional[bytes]:
+        """read for a response streamed by an httpx.AsyncClient."""
+        if not self.accepts(response):
+            return None
+        start = time.perf_counter()
+        chunks, total, complete = [], 0, True
+        async for chunk in response.aiter_bytes():
+            total += len(chunk)
+            if not self._add(chunks, chunk, total):
+                complete = False
+                break
+        return self._finish(response, chunks, total, complete, time.perf_counter() - start)
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            rate = self.read_bytes / self.read_seconds if self.read_seconds else 0.0
+            return {
+                'skipped_content_type': self.skipped_content_type,
+                'skipped_too_large': self.skipped_too_large,
+                'saved_bytes': self.saved_bytes,
+                # Estimated at the average rate of the bodies that were read.
+                'saved_seconds': self.saved_bytes / rate if rate else 0.0,
+                'read_bytes': self.read_bytes,
+            }
+
+
+class AsyncPageFetcher:
+    """Downloads web pages concurrently on one httpx.AsyncClient.
+
+    The client lives on an event loop in a background thread, so keep-alive (and HTTP/2) connections are
+    reused across batches and across the threads that call fetch_many. Concurrency is capped globally
+    (max_connections) and per host (max_per_host), so one slow site cannot take every slot.
+    """
+
+    def __init__(self, max_connections: int = 64, max_per_host: int = 4, timeout: float = 8.0,
+                 connect_timeout: float = 4.0, http2: bool = True, verify: bool = False,
+                 latency_window: int = 10000, cache: Optional[PageCache] = None,
+                 guard: Optional[DownloadGuard] = None):
+        """
+        Args:
+            max_connections: Maximum number of requests in flight, and of pooled connections.
+            max_per_host: Maximum number of requests in flight to one host.
+            timeout: Read/write/pool timeout of a request in seconds.
+            connect_timeout: Timeout for establishing a connection in seconds.
+            http2: Negotiate HTTP/2 where the server supports it (requires the h2 package; falls back to
+                HTTP/1.1 without it).
+            latency_window: Number of most recent request latencies kept for the percentiles in get_stats.
+            cache: Serve fresh pages from this PageCache without a request and revalidate stale ones.
+            guard: Limits on the content type and size of the bodies read; bodies are read whole without one.
+        """
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2
+        self.verify = verify
+        self.cache = cache
+        self.guard = guard or DownloadGuard(max_bytes=None, content_types=None)
+        self._loop = None
+        self._client = None
+        self._slots = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._active_batches = 0
+        self._busy_since = 0.0
+
+    def _make_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        try:
+            return httpx.AsyncClient(verify=self.verify, http2=self.http2, limits=limits, timeout=self.timeout,
+                                     follow_redirects=True)
+        except ImportError:
+            logging.warning('h2 is not installed, fetching over HTTP/1.1: pip install httpx[http2]')
+            return httpx.AsyncClient(verify=self.verify, limits=limits, timeout=self.timeout, follow_redirects=True)
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name='AsyncPageFetcher').start()
+                self._client = self._make_client()
+                self._slots = asyncio.Semaphore(self.max_connections)
+                self._loop = loop
+            return self._loop
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_slots[host]
+
+    async def fetch(self, url: str) -> Optional[bytes]:
+        """The body of url, or None if the request fails or returns an error status."""
+        # The sqlite cache blocks, so it is used from worker threads rather than the event loop.
+        if self.cache is not None:
+            cached, content = await asyncio.to_thread(self.cache.lookup, url)
+            if cached:
+                return content
+        async with self._host_slot(url), self._slots:
+            start = time.perf_counter()
+            # Error statuses and rejected pages are recorded in the cache; network errors may be transient.
+            failure = None
+            try:
+                headers = None
+                if self.cache is not None:
+                    headers = await asyncio.to_thread(self.cache.conditional_headers, url)
+                async with self._client.stream('GET', url, headers=headers) as res:
+                    if res.status_code >= 400:
+                        res.raise_for_status()
+                    content = await self.guard.aread(res) if res.status_code != 304 else b''
+                if content is None:
+                    failure = 'rejected'
+                elif self.cache is not None:
+                    content = await asyncio.to_thread(self.cache.update, url, res.status_code, content, res.headers)
+            except httpx.HTTPStatusError as exc:
+                print(f"Error while requesting {url!r} - {exc!r}")
+                content, failure = None, f'status {exc.response.status_code}'
+            except httpx.HTTPError as exc:
+                print(f"Error while requesting {url!r} - {exc!r}")
+                content = None
+            if self.cache is not None and failure is not None:
+                await asyncio.to_thread(self.cache.put_failure, url, failure)
+            latency = time.perf_counter() - start
+        with self._stats_lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            if content is None:
+                self.failures += 1
+            else:
+                self.bytes += len(content)
+        return content
+
+    async def _fetch_and_report(self, i: int, url: str, on_result: Callable[[int, Optional[bytes]], None]):
+        content = await self.fetch(url)
+        on_result(i, content)
+        return content
+
+    async def fetch_all(self, urls: List[str],
+                        on_result: Optional[Callable[[int, Optional[bytes]], None]] = None) -> List[Optional[bytes]]:
+        """
+        fetch for every URL, in order. on_result(i, body) is called on the event loop as soon as urls[i]
+        completes, so the caller can start processing pages while the rest are still downloading; it must
+        not block.
+        """
+        # busy_seconds counts wall time with at least one batch in flight, so overlapping batches count once.
+        with self._stats_lock:
+            if self._active_batches == 0:
+                self._busy_since = time.perf_counter()
+            self._active_batches += 1
+        try:
+            if on_result is None:
+                return list(await asyncio.gather(*(self.fetch(url) for url in urls)))
+            return list(await asyncio.gather(*(self._fetch_and_report(i, url, on_result) for i, url in enumerate(urls))))
+        finally:
+            with self._stats_lock:
+                self._active_batches -= 1
+                if self._active_batches == 0:
+                    self.busy_seconds += time.perf_counter() - self._busy_since
+
+    def fetch_many(self, urls: List[str],
+                   on_result: Optional[Callable[[int, Optional[bytes]], None]] = None) -> List[Optional[bytes]]:
+        """Blocking fetch_all for synchronous callers; safe to call from several threads at once."""
+        if not urls:
+            return []
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(self.fetch_all(urls, on_result), loop).result()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Request counts, throughput over the time spent in fetch_all and latency percentiles in seconds."""
+        with self._stats_lock:
+            latencies = np.asarray(self._latencies)
+            stats = {
+                'requests': self.requests,
+                'failures': self.failures,
+                'bytes': self.bytes,
+                'busy_seconds': self.busy_seconds,
+                'pages_per_second': (self.requests - self.failures) / self.busy_seconds if self.busy_seconds else 0.0,
+                'bytes_per_second': self.bytes / self.busy_seconds if self.busy_seconds else 0.0,
+            }
+        for p in (50, 90, 99):
+            stats[f'latency_p{p}'] = float(np.percentile(latencies, p)) if len(latencies) else 0.0
+        return stats
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+            self._client = None
+            self._host_slots = {}
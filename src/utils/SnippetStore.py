@@ -0,0 +1,88 @@
+import hashlib
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class SnippetStore:
+    """Content-addressed store of the search results collected by a mind map.
+
+    Every snippet is hashed once and kept once, whatever number of nodes, URLs or retrieval rows refer
+    to it. Callers hold snippet IDs and (url, snippet IDs, metadata) references instead of copies of the
+    text. The metadata (title, description, ...) of each reference is kept as found, since different
+    searches may describe the same URL differently; identical metadata is shared.
+    """
+
+    def __init__(self):
+        self._snippets = {}
+        self._pages = {}
+        self._page_snippet_ids = {}
+        self._id_tuples = {}
+        self._metadata = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def snippet_id(snippet: str) -> str:
+        return hashlib.blake2b(snippet.encode('utf-8'), digest_size=12).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._snippets)
+
+    def add_listener(self, listener: Callable[[str, Tuple[str, ...]], None]):
+        """Call listener(url, snippet IDs) for every page already stored and for every new page from now on."""
+        with self._lock:
+            self._listeners.append(listener)
+            pages = list(self._page_snippet_ids.items())
+        for url, snippet_ids in pages:
+            listener(url, snippet_ids)
+
+    def add_snippet(self, snippet: str) -> str:
+        snippet_id = self.snippet_id(snippet)
+        with self._lock:
+            self._snippets.setdefault(snippet_id, snippet)
+        return snippet_id
+
+    def add_info(self, info: Dict) -> Tuple[str, Tuple[str, ...], Tuple]:
+        """
+        Store one search result dict ('url', 'snippets', and metadata). Returns its (url, snippet IDs, metadata)
+        reference, where metadata holds the other (key, value) items.
+        """
+        url = info.get('url')
+        snippet_ids = tuple(self.add_snippet(snippet) for snippet in info.get('snippets', []))
+        metadata = tuple((k, v) for k, v in info.items() if k != 'snippets')
+        with self._lock:
+            # Identical ID tuples and metadata are shared, since the same page is usually found by many nodes.
+            snippet_ids = self._id_tuples.setdefault(snippet_ids, snippet_ids)
+            try:
+                metadata = self._metadata.setdefault(metadata, metadata)
+            except TypeError:
+                pass  # Unhashable metadata values are kept unshared.
+            is_new_page = url not in self._pages
+            if is_new_page:
+                self._pages[url] = metadata
+                self._page_snippet_ids[url] = snippet_ids
+            listeners = list(self._listeners) if is_new_page else []
+        for listener in listeners:
+            listener(url, snippet_ids)
+        return url, snippet_ids, metadata
+
+    def get_snippet(self, snippet_id: str) -> str:
+        return self._snippets[snippet_id]
+
+    def get_snippets(self, snippet_ids) -> List[str]:
+        return [self._snippets[snippet_id] for snippet_id in snippet_ids]
+
+    def get_info(self, url: str, snippet_ids, metadata: Optional[Tuple] = None) -> Dict:
+        """
+        Rebuild the search result dict of a (url, snippet IDs, metadata) reference. Without metadata, that
+        of the first result stored for the URL is used.
+        """
+        info = dict(self._pages[url] if metadata is None else metadata)
+        info['snippets'] = self.get_snippets(snippet_ids)
+        return info
+
+    def iter_pages(self) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """Yield (url, snippet IDs) once per URL, in the order the URLs were first stored."""
+        with self._lock:
+            pages = list(self._page_snippet_ids.items())
+        yield from pages
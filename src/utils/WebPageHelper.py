@@ -1,26 +1,89 @@
 import concurrent.futures
-from typing import List, Dict
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 
 import httpx
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from trafilatura import extract
 
+from src.utils.PageCache import PageCache
+from src.utils.PageFetcher import AsyncPageFetcher, DownloadGuard
+
+_extract_pools: Dict[int, concurrent.futures.ProcessPoolExecutor] = {}
+_extract_pools_lock = threading.Lock()
+
+
+def extract_text(html) -> Optional[str]:
+    """The main text of an HTML page (module level so that extraction processes can run it)."""
+    return extract(
+        html,
+        include_tables=False,
+        include_comments=False,
+        output_format="txt",
+    )
+
+
+def get_extract_pool(processes: int) -> concurrent.futures.ProcessPoolExecutor:
+    """The process-wide extraction pool with this many workers, shared by every WebPageHelper."""
+    with _extract_pools_lock:
+        if processes not in _extract_pools:
+            # forkserver children do not inherit the threads (fetcher loop, encoder workers) of this process.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+            _extract_pools[processes] = concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context(method))
+        return _extract_pools[processes]
+
+
+def discard_extract_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    """Drop a broken extraction pool so that the next get_extract_pool call starts a new one."""
+    with _extract_pools_lock:
+        for processes, cached in list(_extract_pools.items()):
+            if cached is pool:
+                del _extract_pools[processes]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
 class WebPageHelper:
     """Helper class to process web pages.
 
     Acknowledgement: Part of the code is adapted from https://github.com/stanford-oval/WikiChat project.
     """
 
-    def __init__(self, min_char_count: int = 150, snippet_chunk_size: int = 1000, max_thread_num: int = 10):
+    def __init__(self, min_char_count: int = 150, snippet_chunk_size: int = 1000, max_thread_num: int = 10,
+                 async_fetch: bool = True, max_per_host: int = 4, page_cache_path: Optional[str] = None,
+                 extract_processes: Optional[int] = None, max_page_bytes: Optional[int] = 2 * 1024 ** 2):
         """
         Args:
             min_char_count: Minimum character count for the article to be considered valid.
             snippet_chunk_size: Maximum character count for each snippet.
-            max_thread_num: Maximum number of threads to use for concurrent requests (e.g., downloading webpages).
+            max_thread_num: Maximum number of concurrent requests (e.g., downloading webpages).
+            async_fetch: Download with an AsyncPageFetcher (shared keep-alive/HTTP/2 connections, per-host
+                limits, self.fetcher.get_stats()) instead of a thread pool over a synchronous client.
+            max_per_host: Maximum number of concurrent requests to one host when async_fetch is set.
+            page_cache_path: sqlite file of a PageCache holding downloaded pages and their extracted text
+                across runs. Defaults to the PAGE_CACHE_PATH environment variable; no cache if neither is set.
+            extract_processes: Number of processes extracting page text with trafilatura while downloads are
+                still running (default: min(4, CPU count - 1)). 0 extracts on the calling thread after downloading.
+            max_page_bytes: Pages are streamed and dropped once larger than this (None for no limit), and
+                non-HTML content types are dropped before their body is read. Bytes and time saved are
+                reported by self.download_guard.get_stats().
         """
         self.httpx_client = httpx.Client(verify=False)
+        page_cache_path = page_cache_path or os.getenv('PAGE_CACHE_PATH')
+        self.page_cache = PageCache(page_cache_path) if page_cache_path else None
+        self.download_guard = DownloadGuard(max_bytes=max_page_bytes)
+        self.fetcher = AsyncPageFetcher(max_connections=max_thread_num, max_per_host=max_per_host,
+                                        cache=self.page_cache, guard=self.download_guard) if async_fetch else None
         self.min_char_count = min_char_count
         self.max_thread_num = max_thread_num
+        if extract_processes is None:
+            extract_processes = min(4, (os.cpu_count() or 1) - 1)
+        self.extract_processes = extract_processes
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=snippet_chunk_size,
             chunk_overlap=0,
@@ -42,30 +105,110 @@ class WebPageHelper:
         )
 
     def download_webpage(self, url: str):
+        if self.page_cache is not None:
+            cached, content = self.page_cache.lookup(url)
+            if cached:
+                return content
         try:
-            res = self.httpx_client.get(url, timeout=4)
-            if res.status_code >= 400:
-                res.raise_for_status()
-            return res.content
+            headers = self.page_cache.conditional_headers(url) if self.page_cache is not None else None
+            with self.httpx_client.stream('GET', url, timeout=4, headers=headers) as res:
+                if res.status_code >= 400:
+                    res.raise_for_status()
+                content = self.download_guard.read(res) if res.status_code != 304 else b''
+            if self.page_cache is not None:
+                if content is None:
+                    self.page_cache.put_failure(url, 'rejected')
+                else:
+                    return self.page_cache.update(url, res.status_code, content, res.headers)
+            return content
+        except httpx.HTTPStatusError as exc:
+            print(f"Error while requesting {exc.request.url!r} - {exc!r}")
+            if self.page_cache is not None:
+                self.page_cache.put_failure(url, f'status {exc.response.status_code}')
+            return None
         except httpx.HTTPError as exc:
             print(f"Error while requesting {exc.request.url!r} - {exc!r}")
             return None
 
-    def urls_to_articles(self, urls: List[str]) -> Dict:
+    def download_webpages(self, urls: List[str],
+                          on_page: Optional[Callable[[int, Optional[bytes]], None]] = None) -> List:
+        """download_webpage for every URL, in order. on_page(i, body) is called as each page arrives."""
+        if self.fetcher is not None:
+            return self.fetcher.fetch_many(urls, on_page)
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num) as executor:
-            htmls = list(executor.map(self.download_webpage, urls))
+            futures = {executor.submit(self.download_webpage, url): i for i, url in enumerate(urls)}
+            htmls = [None] * len(urls)
+            for future in concurrent.futures.as_completed(futures):
+                htmls[futures[future]] = future.result()
+                if on_page is not None:
+                    on_page(futures[future], htmls[futures[future]])
+            return htmls
 
-        articles = {}
+    def _iter_texts(self, urls: List[str]) -> Iterator[Tuple[int, Optional[str]]]:
+        """(i, text) for every downloaded urls[i], in the order the texts become available."""
+        pool = get_extract_pool(self.extract_processes) if self.extract_processes > 0 else None
+        # on_page runs on the fetcher's event loop, so it only queues the page; the cache lookup and the
+        # extraction are started here. Extraction results come back on the same queue.
+        ready = queue.Queue()
+
+        def download():
+            try:
+                self.download_webpages(urls, lambda i, html: ready.put(('page', i, html)))
+            except Exception as exc:
+                ready.put(('error', None, exc))
+
+        threading.Thread(target=download, daemon=True, name='WebPageHelper').start()
+        # Events still to come: one per URL, plus one per extraction in flight.
+        remaining = len(urls)
+        while remaining:
+            kind, i, value = ready.get()
+            if kind == 'error':
+                raise value
+            remaining -= 1
+            if kind == 'extracted':
+                extraction, html, extraction_pool = value
+                try:
+                    text = extraction.result()
+                except Exception as exc:
+                    logging.warning(f'Extraction process failed for {urls[i]}, extracting in process: {exc!r}')
+                    if isinstance(exc, BrokenProcessPool):
+                        # A dead worker breaks the whole pool; the remaining pages go to a new one.
+                        discard_extract_pool(extraction_pool)
+                        pool = get_extract_pool(self.extract_processes)
+                    text = extract_text(html)
+            else:
+                html = value
+                if html is None:
+                    continue
+                text = self.page_cache.get_text(urls[i]) if self.page_cache is not None else None
+                if text is not None:
+                    yield i, text
+                    continue
+                if pool is not None:
+                    try:
+                        # Extraction starts while the other pages are still downloading.
+                        extraction = pool.submit(extract_text, html)
+                    except Exception as exc:
+                        logging.warning(f'Extraction pool unavailable, extracting in process: {exc!r}')
+                        if isinstance(exc, BrokenProcessPool):
+                            discard_extract_pool(pool)
+                            pool = get_extract_pool(self.extract_processes)
+                    else:
+                        remaining += 1
+                        extraction.add_done_callback(lambda future, i=i, html=html, extraction_pool=pool: ready.put(
+                            ('extracted', i, (future, html, extraction_pool))))
+                        continue
+                text = extract_text(html)
+            if self.page_cache is not None:
+                self.page_cache.put_text(urls[i], text)
+            yield i, text
+
+    def urls_to_articles(self, urls: List[str]) -> Dict:
+        texts = dict(self._iter_texts(urls))
 
-        for h, u in zip(htmls, urls):
-            if h is None:
-                continue
-            article_text = extract(
-                h,
-                include_tables=False,
-                include_comments=False,
-                output_format="txt",
-            )
+        articles = {}
+        for i, u in enumerate(urls):
+            article_text = texts.get(i)
             if article_text is not None and len(article_text) > self.min_char_count:
                 articles[u] = {"text": article_text}
 
@@ -77,3 +220,13 @@ class WebPageHelper:
             articles[u]["snippets"] = self.text_splitter.split_text(articles[u]["text"])
 
         return articles
+
+    def iter_urls_to_snippets(self, urls: List[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        urls_to_snippets as a generator: yields (url, snippets) for each valid page as soon as it is
+        downloaded and extracted, in completion order, so callers can start on the first pages instead of
+        waiting for the slowest host. Downloads continue in the background if the caller stops early.
+        """
+        for i, text in self._iter_texts(urls):
+            if text is not None and len(text) > self.min_char_count:
+                yield urls[i], self.text_splitter.split_text(text)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# Add repository root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.tools.mindmap import ConceptGenerator, MindMap, MindPoint
+
+
+class Retriever:
+    """Returns one page per keyword and raises for keywords listed in fail."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def __call__(self, query_or_queries, exclude_urls=[]):
+        queries = [query_or_queries] if isinstance(query_or_queries, str) else query_or_queries
+        self.calls.append(list(queries))
+        if self.fail & set(queries):
+            raise RuntimeError('search failed')
+        return [{'url': f'https://example.com/{query}', 'title': query, 'description': '',
+                 'snippets': [f'{query} snippet']} for query in queries]
+
+
+@pytest.fixture(autouse=True)
+def offline_lm(monkeypatch):
+    # Every node proposes the categories <category>/0 and <category>/1 with one keyword each.
+    monkeypatch.setattr(MindPoint, '_generate_keywords',
+                        lambda self: ''.join(f'-[{self.category}/{i}]\n--{{{self.category}/{i}}}\n' for i in range(2)))
+    monkeypatch.setattr(ConceptGenerator, 'forward', lambda self, infos: ['concept'])
+
+
+def make_map(retriever, depth, **kwargs):
+    return MindMap(retriever, gen_concept_lm=None, depth=depth, search_cache=False, incremental_table=False, **kwargs)
+
+
+def tree(node):
+    return {category: tree(child) for category, child in node.children.items()}
@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+from conftest import Retriever, make_map, tree
+
+
+async def collect(mind_map, topic):
+    return [layer async for layer in mind_map.abuild_map(topic)]
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_failed_extend_builds_same_tree(pipelined):
+    built = make_map(Retriever(fail={'topic/0/1'}), depth=4)
+    list(built.build_map('topic', pipelined=pipelined))
+
+    mind_map = make_map(Retriever(fail={'topic/0/1'}), depth=4)
+    asyncio.run(collect(mind_map, 'topic'))
+
+    assert mind_map.root.children['topic/0'].children == {}
+    assert tree(mind_map.root) == tree(built.root)
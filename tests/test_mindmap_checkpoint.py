@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from conftest import Retriever, make_map, tree
+
+
+def test_failed_extend_with_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.jsonl')
+    # topic/0 gets its first child before the search of the second one fails.
+    retriever = Retriever(fail={'topic/0/1'})
+    mind_map = make_map(retriever, depth=4)
+    list(mind_map.build_map('topic', checkpoint_path=checkpoint_path))
+
+    assert mind_map.root.children['topic/0'].children == {}
+    assert tree(mind_map.root.children['topic/1']) == {
+        'topic/1/0': {'topic/1/0/0': {}, 'topic/1/0/1': {}},
+        'topic/1/1': {'topic/1/1/0': {}, 'topic/1/1/1': {}},
+    }
+
+    # Resuming redoes the failed extend and its subtree only.
+    retriever = Retriever()
+    resumed = make_map(retriever, depth=4)
+    list(resumed.build_map('topic', checkpoint_path=checkpoint_path, resume=True))
+    assert sorted(query for queries in retriever.calls for query in queries) == [
+        'topic/0/0', 'topic/0/0/0', 'topic/0/0/1', 'topic/0/1', 'topic/0/1/0', 'topic/0/1/1']
+    assert tree(resumed.root.children['topic/0']) == {
+        'topic/0/0': {'topic/0/0/0': {}, 'topic/0/0/1': {}},
+        'topic/0/1': {'topic/0/1/0': {}, 'topic/0/1/1': {}},
+    }
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_resume_from_torn_checkpoint(tmp_path, pipelined):
+    checkpoint_path = tmp_path / 'checkpoint.jsonl'
+    full = make_map(Retriever(), depth=3)
+    list(full.build_map('topic', checkpoint_path=str(checkpoint_path), pipelined=pipelined))
+
+    # A crash in the middle of the last write leaves a torn "extended" record.
+    content = checkpoint_path.read_bytes()
+    checkpoint_path.write_bytes(content[:-10])
+    last_extend = json.loads(content.decode('utf-8').splitlines()[-1])['path']
+
+    retriever = Retriever()
+    resumed = make_map(retriever, depth=3)
+    list(resumed.build_map('topic', checkpoint_path=str(checkpoint_path), resume=True, pipelined=pipelined))
+
+    assert tree(resumed.root) == tree(full.root)
+    assert sorted(query for queries in retriever.calls for query in queries) == [
+        f"{last_extend[-1]}/0", f"{last_extend[-1]}/1"]
+    # The rewritten file parses completely and holds every extend again.
+    records = [json.loads(line) for line in checkpoint_path.read_text(encoding='utf-8').splitlines()]
+    assert sum(record['type'] == 'extended' for record in records) == 3